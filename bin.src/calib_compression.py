@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Uncompressed copies of the bundled calibrations, and a benchmark of
+compressed versus uncompressed reads and writes.
+
+The bias, dark and flat frames in ``input_data`` are tile compressed with
+``fpack -g2`` and ``calexp`` is written with the ``lossy16`` recipe of the
+seed configuration. ``expand`` writes a mirror of the imported part of
+``input_data`` in which the compressed images are stored uncompressed; it
+can be imported with the same ``export.yaml``. The decompressed pixel
+values are exactly what reading the compressed files gives, so processing
+results do not change.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import warnings
+
+import click
+
+# Raws are ingested, not imported, so are not mirrored.
+SKIP_DIRS = (os.path.join("HSC", "raw"),)
+
+
+def expand_file(source, destination):
+    """Copy a FITS file, decompressing any tile-compressed image HDUs.
+
+    Returns
+    -------
+    expanded : `bool`
+        Whether the file had compressed HDUs. Files without any are
+        hardlinked (or copied) instead of rewritten.
+    """
+    from astropy.io import fits
+
+    # Written under a temporary name and moved into place, so that an
+    # interrupted run never leaves a partial file at the destination.
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".partial-",
+                                   suffix=os.path.basename(destination))
+    os.close(fd)
+    try:
+        with fits.open(source, memmap=False) as hdus:
+            expanded = any(isinstance(hdu, fits.CompImageHDU) for hdu in hdus)
+            if expanded:
+                output = fits.HDUList()
+                for hdu in hdus:
+                    if isinstance(hdu, fits.CompImageHDU):
+                        hdu = fits.ImageHDU(data=hdu.data, header=hdu.header)
+                    output.append(hdu)
+                output.writeto(partial, overwrite=True, output_verify="silentfix")
+        if not expanded:
+            _link_or_copy(source, partial)
+        os.replace(partial, destination)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return expanded
+
+
+def _link_or_copy(source, destination):
+    """Hardlink a file, or copy it if it can not be linked, replacing any
+    existing destination.
+    """
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def is_complete(source, destination):
+    """Return whether ``destination`` is a complete, up-to-date mirror of
+    ``source``.
+
+    A FITS file is complete if every HDU can be read and the last one ends
+    at the end of the file; any other file must be the size of its source.
+    """
+    from astropy.io import fits
+
+    if not os.path.exists(destination) or os.path.getmtime(destination) < os.path.getmtime(source):
+        return False
+    if not destination.endswith(".fits"):
+        return os.path.getsize(destination) == os.path.getsize(source)
+    # Truncated files are expected here; astropy warns about them.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            with fits.open(destination, memmap=False, lazy_load_hdus=False) as hdus:
+                info = hdus[-1].fileinfo()
+        except (OSError, ValueError, IndexError):
+            return False
+    return info["datLoc"] + info["datSpan"] == os.path.getsize(destination)
+
+
+def expand_tree(input_dir, output_dir):
+    """Mirror the imported files of ``input_dir`` with images uncompressed.
+
+    Complete files already present in ``output_dir`` and newer than their
+    source are left alone, so repeated calls are cheap.
+
+    Returns
+    -------
+    counts : `dict` [`str`, `int`]
+        Numbers of files expanded, linked and already up to date.
+    """
+    counts = {"expanded": 0, "linked": 0, "up to date": 0}
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        relative = os.path.relpath(dirpath, input_dir)
+        dirnames[:] = [d for d in dirnames if os.path.normpath(os.path.join(relative, d)) not in SKIP_DIRS]
+        os.makedirs(os.path.join(output_dir, relative), exist_ok=True)
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            destination = os.path.join(output_dir, relative, filename)
+            if is_complete(source, destination):
+                counts["up to date"] += 1
+            elif filename.endswith(".fits"):
+                counts["expanded" if expand_file(source, destination) else "linked"] += 1
+            else:
+                _link_or_copy(source, destination)
+                counts["linked"] += 1
+    return counts
+
+
+def _best_time(func, repeats):
+    """Return the result of the last call and the fastest of several calls.
+    """
+    samples = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - t0)
+    return result, min(samples)
+
+
+def time_calexp_writes(exposure, seed_config, repeats):
+    """Time ``butler.put`` of a calexp with the seed configuration's write
+    recipe and without any recipe.
+
+    Returns
+    -------
+    results : `dict` [`str`, `tuple`]
+        Best write time and file size for each configuration.
+    """
+    from lsst.daf.butler import Butler, Config, DatasetType
+
+    compressed = Config(seed_config)
+    uncompressed = Config(seed_config)
+    uncompressed["datastore", "formatters", "calexp"] = {
+        "formatter": compressed["datastore", "formatters", "calexp", "formatter"]
+    }
+
+    results = {}
+    for name, config in (("lossy16", compressed), ("uncompressed", uncompressed)):
+        with tempfile.TemporaryDirectory() as root:
+            Butler.makeRepo(root, config=config)
+            butler = Butler(root, writeable=True, run="bench")
+            # A dimensionless dataset type named calexp picks up the same
+            # formatter configuration as the real one.
+            butler.registry.registerDatasetType(DatasetType("calexp", [], "ExposureF",
+                                                            universe=butler.dimensions))
+            samples = []
+            size = 0
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                ref = butler.put(exposure, "calexp")
+                samples.append(time.perf_counter() - t0)
+                size = os.path.getsize(butler.getURI(ref).ospath)
+                butler.pruneDatasets([ref], purge=True, unstore=True, disassociate=True)
+            results[name] = (min(samples), size)
+    return results
+
+
+@click.group()
+def cli():
+    """Expand compressed calibrations and benchmark compression costs."""
+
+
+@cli.command()
+@click.option("--input", "input_dir", default="input_data", show_default=True,
+              help="Directory holding export.yaml and the files it refers to.")
+@click.option("--output", "output_dir", default="calib_cache", show_default=True,
+              help="Directory to write the uncompressed mirror to.")
+def expand(input_dir, output_dir):
+    """Write a mirror of --input with compressed images expanded.
+
+    Import it with ``butler import REPO OUTPUT --export-file
+    INPUT/export.yaml``.
+    """
+    t0 = time.perf_counter()
+    counts = expand_tree(input_dir, output_dir)
+    print(", ".join(f"{n} {what}" for what, n in counts.items()) + f" in {time.perf_counter() - t0:.2f}s")
+
+
+@cli.command()
+@click.argument("repo")
+@click.option("--input", "input_dir", default="input_data", show_default=True,
+              help="Directory with the compressed calibrations.")
+@click.option("--cache", "cache_dir", default="calib_cache", show_default=True,
+              help="Mirror written by the expand command.")
+@click.option("--seed-config", default="configs/butler-seed.yaml", show_default=True,
+              help="Seed configuration holding the calexp write recipe.")
+@click.option("--collection", default="demo_collection", show_default=True,
+              help="Collection to read the calexp to write from.")
+@click.option("--repeats", default=3, show_default=True, help="Number of timed reads and writes.")
+def bench(repo, input_dir, cache_dir, seed_config, collection, repeats):
+    """Time ISR calibration reads and calexp writes with and without
+    compression.
+    """
+    from lsst.afw.image import ExposureF
+    from lsst.daf.butler import Butler
+
+    print(f"{'calibration':60s} {'compressed':>12s} {'uncompressed':>14s}")
+    totals = [0.0, 0.0]
+    calib_dir = os.path.join(input_dir, "HSC", "calib")
+    for dirpath, _, filenames in sorted(os.walk(calib_dir)):
+        for filename in sorted(filenames):
+            if not filename.startswith(("bias", "dark", "flat")):
+                continue
+            source = os.path.join(dirpath, filename)
+            expanded = os.path.join(cache_dir, os.path.relpath(source, input_dir))
+            _, compressed_time = _best_time(lambda: ExposureF(source), repeats)
+            _, expanded_time = _best_time(lambda: ExposureF(expanded), repeats)
+            totals[0] += compressed_time
+            totals[1] += expanded_time
+            print(f"{filename:60s} {compressed_time * 1000:10.1f}ms {expanded_time * 1000:12.1f}ms")
+    print(f"{'total':60s} {totals[0] * 1000:10.1f}ms {totals[1] * 1000:12.1f}ms")
+
+    butler = Butler(repo, writeable=False)
+    exposure = butler.get("calexp", instrument="HSC", visit=903342, detector=10, collections=collection)
+    print(f"\n{'calexp write':60s} {'time':>12s} {'size':>14s}")
+    for name, (seconds, size) in time_calexp_writes(exposure, seed_config, repeats).items():
+        print(f"{name:60s} {seconds * 1000:10.1f}ms {size / 2**20:10.1f} MiB")
+    print(f"Best of {repeats} repeats.")
+
+
+if __name__ == "__main__":
+    cli()
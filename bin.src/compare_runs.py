@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare the content of the datasets written by two runs of the pipeline.
+
+Datasets are matched on dataset type and data ID. The image, mask and
+variance planes of exposures are read and compared one strip of rows at a
+time, through their component datasets. Other images and catalogs are read
+whole, then compared one strip of rows or one column at a time. The largest
+differences are reported for each dataset type.
+Datasets are spread over a pool of processes, each with its own butler.
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import click
+import numpy as np
+
+# Storage classes whose pixel planes are compared.
+IMAGE_STORAGE_CLASSES = ("ExposureF", "ExposureI", "MaskedImageF", "ImageF")
+
+# Storage classes with a bbox component, whose planes are read as strips of
+# their component datasets.
+EXPOSURE_STORAGE_CLASSES = ("ExposureF", "ExposureI")
+EXPOSURE_PLANES = ("image", "mask", "variance")
+
+# Storage classes whose columns are compared.
+CATALOG_STORAGE_CLASSES = ("SourceCatalog", "ArrowAstropy", "ArrowTable", "ArrowNumpy", "DataFrame",
+                           "AstropyTable")
+
+# Number of rows of a plane compared at once.
+STRIP_ROWS = 256
+
+# Butler of a worker process, created by the pool initializer.
+_butler = None
+
+
+def _init_worker(repo):
+    global _butler
+    from lsst.daf.butler import Butler
+
+    _butler = Butler(repo, writeable=False)
+
+
+def compare_arrays(a, b, rtol=0.0, atol=0.0, strip_rows=STRIP_ROWS):
+    """Compare two arrays of the same shape a strip of rows at a time.
+
+    NaNs in the same place compare equal.
+
+    Returns
+    -------
+    result : `dict`
+        Maximum absolute difference, number of elements differing by more
+        than the tolerance and number of elements compared.
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if a.shape != b.shape:
+        return {"max_abs_diff": float("inf"), "n_different": max(a.size, b.size), "n_compared": 0}
+    a = a.reshape(a.shape[0], -1) if a.ndim > 1 else a.reshape(-1, 1)
+    b = b.reshape(a.shape)
+    numeric = np.issubdtype(a.dtype, np.number) and np.issubdtype(b.dtype, np.number)
+    max_abs_diff = 0.0
+    n_different = 0
+    for start in range(0, a.shape[0], strip_rows):
+        strip_a = a[start:start + strip_rows]
+        strip_b = b[start:start + strip_rows]
+        if not numeric:
+            different = strip_a != strip_b
+        elif np.issubdtype(a.dtype, np.integer) and np.issubdtype(b.dtype, np.integer):
+            diff = np.abs(strip_a.astype(np.int64) - strip_b.astype(np.int64))
+            different = diff > atol
+            max_abs_diff = max(max_abs_diff, float(diff.max(initial=0)))
+        else:
+            strip_a = strip_a.astype(np.float64, copy=False)
+            strip_b = strip_b.astype(np.float64, copy=False)
+            with np.errstate(invalid="ignore"):
+                diff = np.abs(strip_a - strip_b)
+                different = ~(diff <= atol + rtol * np.abs(strip_b))
+            # Equal values, including equal infinities, and NaNs in the same
+            # place match; any other NaN difference is an infinite one.
+            same = (strip_a == strip_b) | (np.isnan(strip_a) & np.isnan(strip_b))
+            different &= ~same
+            diff[same] = 0.0
+            diff[np.isnan(diff)] = np.inf
+            max_abs_diff = max(max_abs_diff, float(diff.max(initial=0.0)))
+        n_different += int(np.count_nonzero(different))
+    return {"max_abs_diff": max_abs_diff, "n_different": n_different, "n_compared": int(a.size)}
+
+
+def merge_comparisons(results):
+    """Combine the comparisons of the parts of an array.
+
+    Parameters
+    ----------
+    results : `~collections.abc.Iterable` [`dict`]
+        Results of `compare_arrays` for each part.
+
+    Returns
+    -------
+    result : `dict`
+        The comparison of the whole array.
+    """
+    merged = {"max_abs_diff": 0.0, "n_different": 0, "n_compared": 0}
+    for result in results:
+        merged["max_abs_diff"] = max(merged["max_abs_diff"], result["max_abs_diff"])
+        merged["n_different"] += result["n_different"]
+        merged["n_compared"] += result["n_compared"]
+    return merged
+
+
+def _iter_bbox_strips(bbox, strip_rows=STRIP_ROWS):
+    """Divide a bounding box into boxes of at most ``strip_rows`` rows."""
+    from lsst.geom import Box2I, Extent2I, Point2I
+
+    for y in range(bbox.getMinY(), bbox.getMaxY() + 1, strip_rows):
+        rows = min(strip_rows, bbox.getMaxY() + 1 - y)
+        yield Box2I(Point2I(bbox.getMinX(), y), Extent2I(bbox.getWidth(), rows))
+
+
+def compare_exposure_planes(ref, other_ref, rtol, atol):
+    """Compare the planes of two exposures a strip of rows at a time.
+
+    Each strip of each plane is read through the component dataset with a
+    bbox parameter, so only one pair of strips is in memory at a time.
+
+    Returns
+    -------
+    result : `dict`
+        Comparison of each plane, keyed by its name.
+    """
+    bbox = _butler.get(ref.makeComponentRef("bbox"))
+    if _butler.get(other_ref.makeComponentRef("bbox")) != bbox:
+        return {plane: {"max_abs_diff": float("inf"), "n_different": bbox.getArea(), "n_compared": 0}
+                for plane in EXPOSURE_PLANES}
+    result = {}
+    for plane in EXPOSURE_PLANES:
+        # Resolved component refs are read directly, so no strip repeats
+        # the registry lookup.
+        plane_ref = ref.makeComponentRef(plane)
+        other_plane_ref = other_ref.makeComponentRef(plane)
+        result[plane] = merge_comparisons(
+            compare_arrays(_butler.get(plane_ref, parameters={"bbox": strip}).array,
+                           _butler.get(other_plane_ref, parameters={"bbox": strip}).array,
+                           rtol=rtol, atol=atol)
+            for strip in _iter_bbox_strips(bbox)
+        )
+    return result
+
+
+def _image_planes(obj):
+    """Return the pixel planes of an exposure, masked image or image."""
+    if hasattr(obj, "getMaskedImage"):
+        obj = obj.getMaskedImage()
+    if hasattr(obj, "getImage") and hasattr(obj, "getVariance"):
+        return {"image": obj.image.array, "mask": obj.mask.array, "variance": obj.variance.array}
+    return {"image": obj.array}
+
+
+def _catalog_columns(obj):
+    """Return the columns of a catalog as arrays."""
+    if hasattr(obj, "asAstropy"):
+        obj = obj.asAstropy()
+    if hasattr(obj, "to_numpy") and hasattr(obj, "columns"):
+        return {str(name): obj[name].to_numpy() for name in obj.columns}
+    if hasattr(obj, "column_names"):
+        return {name: obj[name].to_numpy(zero_copy_only=False) for name in obj.column_names}
+    if hasattr(obj, "colnames"):
+        return {name: np.asarray(obj[name]) for name in obj.colnames}
+    return {name: obj[name] for name in obj.dtype.names}
+
+
+def compare_datasets(refs, rtol, atol):
+    """Read a pair of matching datasets and compare their content.
+
+    Runs in a worker process.
+
+    Parameters
+    ----------
+    refs : `tuple` [`lsst.daf.butler.DatasetRef`]
+        The datasets of the two runs.
+    rtol, atol : `float`
+        Relative and absolute tolerances for floating point values.
+
+    Returns
+    -------
+    result : `dict`
+        Comparison of each plane or column, keyed by its name.
+    """
+    ref, other_ref = refs
+    storage_class = ref.datasetType.storageClass_name
+    if storage_class in EXPOSURE_STORAGE_CLASSES:
+        return compare_exposure_planes(ref, other_ref, rtol, atol)
+    if storage_class in IMAGE_STORAGE_CLASSES:
+        extract = _image_planes
+    else:
+        extract = _catalog_columns
+    # Both datasets are read whole; only the comparison itself is done a
+    # strip or column at a time.
+    first = extract(_butler.get(ref))
+    second = extract(_butler.get(other_ref))
+    result = {}
+    for name in sorted(set(first) | set(second)):
+        if name not in first or name not in second:
+            result[name] = {"max_abs_diff": float("inf"), "n_different": 1, "n_compared": 0}
+        else:
+            result[name] = compare_arrays(first[name], second[name], rtol=rtol, atol=atol)
+    return result
+
+
+def match_datasets(butler, collection, other_collection, dataset_types=...):
+    """Match the comparable datasets of two collections.
+
+    Returns
+    -------
+    pairs : `list` [`tuple`]
+        Matching pairs of `lsst.daf.butler.DatasetRef`.
+    unmatched : `list` [`lsst.daf.butler.DatasetRef`]
+        Comparable datasets found in only one of the collections.
+    """
+    comparable = IMAGE_STORAGE_CLASSES + CATALOG_STORAGE_CLASSES
+    found = []
+    for name in (collection, other_collection):
+        found.append({
+            (ref.datasetType.name, ref.dataId): ref
+            for ref in butler.registry.queryDatasets(dataset_types, collections=name, findFirst=True)
+            if ref.datasetType.storageClass_name in comparable and ref.run.startswith(name)
+        })
+    first, second = found
+    pairs = [(first[key], second[key]) for key in sorted(first.keys() & second.keys(), key=str)]
+    unmatched = [refs[key] for refs in found for key in refs.keys() - (first.keys() & second.keys())]
+    return pairs, unmatched
+
+
+@click.command()
+@click.argument("repo")
+@click.argument("collection", default="demo_collection")
+@click.argument("other_collection", default="demo_collection_qbb")
+@click.option("-d", "--dataset-type", "dataset_types", multiple=True,
+              help="Dataset type to compare; may be repeated. All comparable types by default.")
+@click.option("-j", "--processes", default=min(4, os.cpu_count() or 1), show_default=True,
+              help="Number of reading and comparing processes.")
+@click.option("--rtol", default=1e-6, show_default=True, help="Relative tolerance for float values.")
+@click.option("--atol", default=0.0, show_default=True, help="Absolute tolerance for float values.")
+@click.option("--json", "json_file", help="Write the comparison of every dataset to this file.")
+def main(repo, collection, other_collection, dataset_types, processes, rtol, atol, json_file):
+    """Check that the outputs in COLLECTION and OTHER_COLLECTION of REPO
+    hold the same pixels and catalog values.
+
+    Only datasets written to runs of the two collections are compared, not
+    the inputs they share.
+    """
+    from lsst.daf.butler import Butler
+
+    butler = Butler(repo, writeable=False)
+    pairs, unmatched = match_datasets(butler, collection, other_collection, list(dataset_types) or ...)
+    if not pairs:
+        print(f"ERROR: no comparable datasets found in both {collection} and {other_collection}.",
+              file=sys.stderr)
+        sys.exit(1)
+
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(repo,)) as pool:
+        results = list(pool.map(partial(compare_datasets, rtol=rtol, atol=atol), pairs))
+    elapsed = time.perf_counter() - t0
+
+    # Largest difference over all planes or columns of each dataset type.
+    worst = {}
+    report = []
+    for (ref, _), result in zip(pairs, results):
+        report.append({"dataset_type": ref.datasetType.name, "data_id": dict(ref.dataId.required),
+                       "result": result})
+        entry = worst.setdefault(ref.datasetType.name, {"n_datasets": 0, "max_abs_diff": 0.0, "worst": "",
+                                                        "n_different": 0, "differing": set()})
+        entry["n_datasets"] += 1
+        for name, comparison in result.items():
+            if comparison["max_abs_diff"] > entry["max_abs_diff"]:
+                entry["max_abs_diff"] = comparison["max_abs_diff"]
+                entry["worst"] = name
+            if comparison["n_different"]:
+                entry["n_different"] += comparison["n_different"]
+                entry["differing"].add(name)
+
+    print(f"{'dataset type':30s} {'datasets':>8s} {'max |diff|':>12s} {'in':30s} {'differing values':>16s}")
+    for dataset_type, entry in sorted(worst.items()):
+        print(f"{dataset_type:30s} {entry['n_datasets']:8d} {entry['max_abs_diff']:12.4g} "
+              f"{entry['worst']:30s} {entry['n_different']:16d}")
+    print(f"Compared {len(pairs)} dataset pairs in {elapsed:.2f}s with {processes} processes.")
+
+    if json_file:
+        with open(json_file, "w") as fh:
+            json.dump({"collections": [collection, other_collection], "rtol": rtol, "atol": atol,
+                       "datasets": report}, fh, indent=2, default=str)
+
+    failed = False
+    for ref in unmatched:
+        print(f"ERROR: {ref.datasetType.name} {ref.dataId} is only in {ref.run}.", file=sys.stderr)
+        failed = True
+    for dataset_type, entry in sorted(worst.items()):
+        if entry["n_different"]:
+            print(f"ERROR: {dataset_type} differs in {entry['n_different']} values of "
+                  f"{', '.join(sorted(entry['differing']))}.", file=sys.stderr)
+            failed = True
+    sys.exit(int(failed))
+
+
+if __name__ == "__main__":
+    main()
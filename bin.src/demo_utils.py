@@ -0,0 +1,179 @@
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Helpers shared by the scripts in ``bin``."""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Final summary lines of butler transfer-from-graph and aggregate-graph.
+TRANSFER_COUNT_PATTERN = re.compile(r"Number of datasets transferred: (?P<n>\d+)")
+AGGREGATE_COUNT_PATTERN = re.compile(r"Ingested (?P<n>\d+) dataset\(s\)")
+
+# Log options used for butler commands whose output is parsed.
+LOG_OPTIONS = ("--log-level=VERBOSE", "--long-log")
+
+ZIP_PATTERN = re.compile(r"(?P<path>\S+\.zip)\b")
+
+# Stages of run_demo.sh and the stages each one needs to have finished.
+# The pipeline stages all wait for the direct run, which registers the
+# dataset types the others read or would otherwise race to register.
+STAGES = {
+    "seed": (),
+    "input_chain": ("seed",),
+    "main_run": ("input_chain",),
+    "empty_query": ("main_run",),
+    "replace_run": ("main_run",),
+    "qbb": ("main_run",),
+    "bring_home": ("qbb",),
+    "tests": ("main_run", "bring_home"),
+    "compare_runs": ("main_run", "bring_home"),
+    "benchmark": ("main_run",),
+}
+
+# Stages that write to the registry. SQLite lets only one connection write
+# at a time, and a writer that waits longer than the busy timeout fails
+# with "database is locked", so these never run concurrently. The others
+# only read, or write to the registry only briefly while holding
+# REGISTRY_LOCK, which every writer holds for as long as it runs.
+REGISTRY_WRITERS = frozenset({"seed", "input_chain", "main_run", "replace_run", "bring_home"})
+
+# Lock file, relative to the package root, serializing registry writes.
+REGISTRY_LOCK = "registry.lock"
+
+
+class PhaseTimer:
+    """Accumulate wall time per named phase."""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - t0
+
+    def report(self):
+        """Print the time spent in each phase."""
+        for name, seconds in self.phases.items():
+            print(f"{name:>20s}: {seconds:8.3f}s")
+        print(f"{'total':>20s}: {sum(self.phases.values()):8.3f}s")
+
+
+def stream_command(command, echo=False, count_patterns=(TRANSFER_COUNT_PATTERN, AGGREGATE_COUNT_PATTERN)):
+    """Run a command, parsing its output as it is written.
+
+    Parameters
+    ----------
+    command : `list` [`str`]
+        Command to run.
+    echo : `bool`, optional
+        Whether to echo the output of the command.
+    count_patterns : `tuple` [`re.Pattern`], optional
+        Patterns of the lines reporting a dataset count, with the count in
+        group ``n``.
+
+    Returns
+    -------
+    result : `dict`
+        Wall time, time to the first line of output, number of lines, every
+        dataset count reported by the command in order (``counts``), the last
+        of them (``reported``) and any zip file it wrote.
+    """
+    t0 = time.perf_counter()
+    first_output = None
+    n_lines = 0
+    counts = []
+    zip_path = None
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                          bufsize=1) as process:
+        for line in process.stdout:
+            if first_output is None:
+                first_output = time.perf_counter() - t0
+            n_lines += 1
+            if echo:
+                sys.stdout.write(line)
+            for pattern in count_patterns:
+                if m := pattern.search(line):
+                    counts.append(int(m.group("n")))
+                    break
+            if m := ZIP_PATTERN.search(line):
+                zip_path = m.group("path")
+    wall = time.perf_counter() - t0
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return {"command": command, "wall": wall, "first_output": first_output, "n_lines": n_lines,
+            "counts": counts, "reported": counts[-1] if counts else None, "zip": zip_path}
+
+
+def file_digest(path, stamps):
+    """Return the SHA-256 digest of a file, reusing a previous digest if the
+    file size and modification time have not changed.
+    """
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    previous = stamps.get(path)
+    if previous is not None and previous["stamp"] == stamp:
+        return previous["digest"]
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    stamps[path] = {"stamp": stamp, "digest": digest.hexdigest()}
+    return stamps[path]["digest"]
+
+
+@contextlib.contextmanager
+def locked_json(path, empty):
+    """Open a JSON file for update, holding a lock so that processes running
+    in parallel do not lose each other's changes.
+
+    Parameters
+    ----------
+    path : `str`
+        File to update, created if it does not exist.
+    empty : `dict`
+        Content to start from if the file is new or empty.
+
+    Yields
+    ------
+    content : `dict`
+        Content of the file, written back with any changes on exit.
+    """
+    with open(path, "a+") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        fh.seek(0)
+        text = fh.read()
+        content = json.loads(text) if text else empty
+        yield content
+        fh.seek(0)
+        fh.truncate()
+        json.dump(content, fh, indent=2)
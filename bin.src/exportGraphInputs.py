@@ -23,8 +23,103 @@
 
 import os
 import argparse
+import json
+import time
+from collections import defaultdict
+
 from lsst.daf.butler import Butler
-from lsst.pipe.base import QuantumGraph
+from lsst.pipe.base.graph._loadHelpers import LoadHelper
+
+
+def resolve_input_refs(butler, refs_by_type, batch_size=500):
+    """Find the registry datasets matching the data IDs of graph inputs.
+
+    Data IDs are deduplicated and grouped by dataset type, and each group is
+    resolved with one query per ``batch_size`` data IDs rather than one query
+    per input reference.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler to query.
+    refs_by_type : `dict` [`lsst.daf.butler.DatasetType`, `set`]
+        Input dataset references, grouped by dataset type.
+    batch_size : `int`, optional
+        Maximum number of data IDs constrained by a single query.
+
+    Returns
+    -------
+    found : `set` [`lsst.daf.butler.DatasetRef`]
+        All registry datasets matching the requested data IDs, from any
+        collection.
+    n_queries : `int`
+        Number of registry queries issued.
+    elapsed : `float`
+        Time spent in registry queries, in seconds.
+    """
+    found = set()
+    n_queries = 0
+    elapsed = 0.0
+    for datasetType, refs in refs_by_type.items():
+        data_ids = list({ref.dataId for ref in refs})
+        dimensions = list(datasetType.dimensions.required)
+        for start in range(0, len(data_ids), batch_size):
+            batch = data_ids[start:start + batch_size]
+            wanted = set(batch)
+            # Constrain each required dimension to the values seen in this
+            # batch. That can match more data IDs than requested (the cross
+            # product), so the results are filtered afterwards.
+            bind = {f"{name}_values": tuple({data_id[name] for data_id in batch}) for name in dimensions}
+            where = " AND ".join(f"{name} IN ({name}_values)" for name in dimensions)
+            t0 = time.perf_counter()
+            results = butler.registry.queryDatasets(datasetType.name, collections=..., where=where,
+                                                    bind=bind)
+            found.update(ref for ref in results if ref.dataId in wanted)
+            elapsed += time.perf_counter() - t0
+            n_queries += 1
+    return found, n_queries, elapsed
+
+
+def iter_quantum_nodes(graph_uri, universe, batch_size=1000):
+    """Iterate over the quantum nodes of a saved graph without loading the
+    whole graph at once.
+
+    Parameters
+    ----------
+    graph_uri : `str`
+        Location of the saved quantum graph.
+    universe : `lsst.daf.butler.DimensionUniverse`
+        Dimension universe to load the graph with.
+    batch_size : `int`, optional
+        Number of nodes loaded at a time. Zero loads the whole graph.
+
+    Yields
+    ------
+    node : `lsst.pipe.base.QuantumNode`
+        Every node of the graph, one batch in memory at a time.
+    """
+    # The graph is opened and its header, which indexes every node, is read
+    # once; each batch then reads only the byte ranges of its nodes.
+    # QuantumGraph.loadUri would open the graph and read the header again
+    # for every batch.
+    with LoadHelper(graph_uri, minimumVersion=3) as helper:
+        header = helper.readHeader() if batch_size > 0 else None
+        if header is None:
+            # Old graph format without a node index, or batching disabled.
+            yield from helper.load(universe)
+            return
+        nodes = json.loads(header)["Nodes"]
+        node_ids = list(nodes) if isinstance(nodes, dict) else [node_id for node_id, _ in nodes]
+        for start in range(0, len(node_ids), batch_size):
+            yield from helper.load(universe, nodes=node_ids[start:start + batch_size])
+
+
+def positive_int(value):
+    """Parse a strictly positive integer command-line argument."""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, not {value}")
+    return number
 
 
 if __name__ == "__main__":
@@ -32,10 +127,16 @@ if __name__ == "__main__":
     parser.add_argument("butler", help="Directory or butler.yaml to export from")
     parser.add_argument("graph", help="Pickle file containing a quantum graph")
     parser.add_argument("--output", default="staging", help="Directory to export to")
+    parser.add_argument("--batch-size", type=positive_int, default=500,
+                        help="Maximum number of data IDs to resolve in a single registry query")
+    parser.add_argument("--graph-batch-size", type=int, default=1000,
+                        help="Number of quantum graph nodes to load at a time; 0 loads the whole graph")
+    parser.add_argument("--trust-graph-refs", action="store_true",
+                        help="Export the resolved input references stored in the graph without "
+                             "querying the registry. Only valid if the graph was built from this butler.")
     args = parser.parse_args()
 
     butler = Butler(args.butler)
-    graph = QuantumGraph.loadUri(args.graph, universe=butler.dimensions)
 
     # dataset_types_to_save = ("brightObjectMask", "ps1_pv3_3pi_20170110",
     #                          "jointcal_photoCalib", "jointcal_wcs", "bias",
@@ -43,26 +144,38 @@ if __name__ == "__main__":
     #                          "camera", "bfKernel")
     dataset_types_to_exclude = ("raw", "postISRCCD", "icExp", "icExpBackground", "icSrc")
 
+    # Many quanta share the same inputs (calibrations, reference catalog
+    # shards), so deduplicate before going anywhere near the registry.
+    # Raws are only exported for their files, and are collected in the same
+    # pass over the graph.
+    refs_by_type = defaultdict(set)
+    raw_refs = set()
+    t0 = time.perf_counter()
+    n_quanta = 0
+    for quantum_node in iter_quantum_nodes(args.graph, butler.dimensions, batch_size=args.graph_batch_size):
+        n_quanta += 1
+        for datasetType, refs in quantum_node.quantum.inputs.items():
+            if datasetType.name == "raw":
+                raw_refs.update(refs)
+            elif datasetType.name not in dataset_types_to_exclude:
+                refs_by_type[datasetType].update(refs)
+    print(f"Read the inputs of {n_quanta} quanta in {time.perf_counter() - t0:.2f}s")
+
+    if args.trust_graph_refs:
+        items = set().union(*refs_by_type.values())
+    else:
+        # The quantum graph may not know the ID of the
+        # real dataset so convert to a real ref
+        items, n_queries, elapsed = resolve_input_refs(butler, refs_by_type, batch_size=args.batch_size)
+        n_refs = sum(len(refs) for refs in refs_by_type.values())
+        print(f"Resolved {n_refs} input datasets of {len(refs_by_type)} dataset types "
+              f"to {len(items)} registry datasets with {n_queries} queries in {elapsed:.2f}s")
+
     os.makedirs(args.output, exist_ok=True)
     with butler.export(directory=args.output, format="yaml", transfer="auto") as export:
-        items = []
-        for quantum_node in graph:
-            for datasetType, refs in quantum_node.quantum.inputs.items():
-                if datasetType.name not in dataset_types_to_exclude:
-                    # The quantum graph may not know the ID of the
-                    # real dataset so convert to a real ref
-                    for ref in refs:
-                        found = set(butler.registry.queryDatasets(datasetType.name, collections=...,
-                                                                  dataId=ref.dataId))
-                        items.extend(found)
         export.saveDatasets(items)
         export.saveCollection("HSC/calib")
 
     # This is solely to export the raw files. We do not need the yaml
     with butler.export(directory=args.output, filename="junk.yaml", format="yaml", transfer="auto") as export:
-        items = []
-        for quantum in graph.findQuantaWithDSType("raw"):
-            # Verify that raw is an input and not an output
-            if "raw" in quantum.inputs:
-                items.extend(quantum.inputs["raw"])
-        export.saveDatasets(items)
+        export.saveDatasets(raw_refs)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Ingest raws and define visits in one process, with timing.
+
+Equivalent to ``butler ingest-raws`` followed by ``butler define-visits``,
+except that raw files are found recursively, headers are read on a pool of
+worker processes and registry inserts are made for batches of exposures.
+"""
+
+import multiprocessing
+import os
+import sys
+
+import click
+
+from demo_utils import PhaseTimer
+
+RAW_SUFFIXES = (".fits", ".fits.fz", ".fz")
+
+
+def find_raw_files(paths):
+    """Return all raw files below the given files or directories."""
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(os.path.abspath(path))
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            files.extend(os.path.abspath(os.path.join(dirpath, filename))
+                         for filename in sorted(filenames) if filename.endswith(RAW_SUFFIXES))
+    return files
+
+
+def read_headers(task, files, processes):
+    """Extract the metadata of all files and group them by exposure.
+
+    Returns
+    -------
+    exposures : `list` [`lsst.obs.base.ingest.RawExposureData`]
+        Exposures with fully expanded data IDs.
+    bad_files : `list` [`lsst.resources.ResourcePath`]
+        Files whose metadata could not be read.
+    """
+    from lsst.resources import ResourcePath
+
+    uris = [ResourcePath(filename) for filename in files]
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            file_data = list(pool.imap_unordered(task.extractMetadata, uris,
+                                                 chunksize=max(1, len(uris) // (4 * processes))))
+    else:
+        file_data = [task.extractMetadata(uri) for uri in uris]
+    bad_files = [data.filename for data in file_data if not data.datasets]
+    good = [data for data in file_data if data.datasets]
+    exposures = [task.expandDataIds(exposure) for exposure in task.groupByExposure(good)]
+    return exposures, bad_files
+
+
+def insert_exposures(butler, task, exposures, run, transfer, batch_size):
+    """Insert exposure records and ingest raws for batches of exposures.
+
+    Returns
+    -------
+    refs : `list` [`lsst.daf.butler.DatasetRef`]
+        The ingested raws.
+    """
+    from lsst.daf.butler import DatasetRef, FileDataset
+
+    registry = butler.registry
+    registry.registerDatasetType(task.datasetType)
+    registry.registerRun(run)
+    refs = []
+    for start in range(0, len(exposures), batch_size):
+        batch = exposures[start:start + batch_size]
+        datasets = []
+        with butler.transaction():
+            for exposure in batch:
+                for element, record in getattr(exposure, "dependencyRecords", {}).items():
+                    registry.syncDimensionData(element, record)
+                registry.syncDimensionData("exposure", exposure.record)
+                for file in exposure.files:
+                    file_refs = [DatasetRef(task.datasetType, dataset.dataId, run=run)
+                                 for dataset in file.datasets]
+                    datasets.append(FileDataset(path=file.filename, refs=file_refs,
+                                                formatter=file.FormatterClass))
+                    refs.extend(file_refs)
+            butler.ingest(*datasets, transfer=transfer, record_validation_info=True)
+    return refs
+
+
+@click.command()
+@click.argument("repo")
+@click.argument("locations", nargs=-1, required=True)
+@click.option("-j", "--processes", default=1, show_default=True, help="Number of header-reading processes.")
+@click.option("--transfer", default="direct", show_default=True, help="Transfer mode for the raw files.")
+@click.option("--batch-size", default=100, show_default=True,
+              help="Number of exposures inserted per transaction.")
+@click.option("--no-visits", is_flag=True, help="Do not define visits for the ingested exposures.")
+def main(repo, locations, processes, transfer, batch_size, no_visits):
+    """Ingest all raw files found below LOCATIONS into REPO and define
+    visits for them.
+    """
+    timer = PhaseTimer()
+    with timer("import"):
+        from lsst.daf.butler import Butler
+        from lsst.obs.base import DefineVisitsConfig, DefineVisitsTask, RawIngestConfig, RawIngestTask
+        from lsst.pipe.base import Instrument
+
+    butler = Butler(repo, writeable=True)
+    config = RawIngestConfig()
+    config.transfer = transfer
+    task = RawIngestTask(config=config, butler=butler)
+
+    with timer("find files"):
+        files = find_raw_files(locations)
+
+    with timer("read headers"):
+        exposures, bad_files = read_headers(task, files, processes)
+    if not exposures:
+        print(f"ERROR: no raws could be read from {len(files)} files.", file=sys.stderr)
+        sys.exit(1)
+
+    instrument = Instrument.from_string(exposures[0].record.instrument, butler.registry)
+    run = instrument.makeDefaultRawIngestRunName()
+    with timer("registry insert"):
+        refs = insert_exposures(butler, task, exposures, run, transfer, batch_size)
+
+    if not no_visits:
+        with timer("define visits"):
+            visit_config = DefineVisitsConfig()
+            instrument.applyConfigOverrides(DefineVisitsTask._DefaultName, visit_config)
+            visit_task = DefineVisitsTask(config=visit_config, butler=butler)
+            visit_task.run([exposure.dataId for exposure in exposures], collections=run)
+
+    n_files = len(files) - len(bad_files)
+    ingest_time = timer.phases["read headers"] + timer.phases["registry insert"]
+    print(f"Ingested {len(refs)} raws from {n_files} files ({len(exposures)} exposures) into {run}: "
+          f"{n_files / ingest_time:.1f} files/s with {processes} processes")
+    timer.report()
+    if bad_files:
+        print(f"ERROR: could not read {len(bad_files)} files: {bad_files}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run the stages of the demo script concurrently where their dependencies
+allow, and report the critical path.
+
+Each stage is a ``stage_NAME`` function of ``bin/run_demo.sh``, run as
+``bin/run_demo.sh --stage NAME`` with its output written to a log file.
+Stages that write to the SQLite registry run one at a time, holding a lock
+that other stages take for their brief registry writes.
+"""
+
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import click
+
+from demo_utils import REGISTRY_LOCK, REGISTRY_WRITERS, STAGES
+
+
+def critical_path(stages, durations):
+    """Find the chain of dependent stages that takes longest.
+
+    Parameters
+    ----------
+    stages : `dict` [`str`, `tuple` [`str`]]
+        Dependencies of each stage, in an order in which they can run.
+    durations : `dict` [`str`, `float`]
+        Duration of each stage.
+
+    Returns
+    -------
+    path : `list` [`str`]
+        Stages on the critical path, in order.
+    length : `float`
+        Sum of their durations.
+    """
+    finish = {}
+    previous = {}
+    for name, needs in stages.items():
+        before = max((need for need in needs if need in finish), key=finish.get, default=None)
+        previous[name] = before
+        finish[name] = durations.get(name, 0.0) + (finish[before] if before else 0.0)
+    if not finish:
+        return [], 0.0
+    name = max(finish, key=finish.get)
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return path[::-1], finish[path[0]]
+
+
+def with_writer_chain(stages, results):
+    """Add the order in which the registry writers ran to the dependencies.
+
+    The writers never overlap, so each one also waits for the writer that
+    ran before it.
+
+    Parameters
+    ----------
+    stages : `dict` [`str`, `tuple` [`str`]]
+        Dependencies of each stage that ran.
+    results : `dict` [`str`, `dict`]
+        Result of each stage, as returned by `run_stage`.
+
+    Returns
+    -------
+    stages : `dict` [`str`, `tuple` [`str`]]
+        Dependencies of each stage including the previous writer, in the
+        order the stages started, which is an order in which they can run.
+    """
+    order = sorted(stages, key=lambda name: results[name]["start"])
+    chained = {}
+    writer = None
+    for name in order:
+        needs = stages[name]
+        if name in REGISTRY_WRITERS:
+            if writer is not None and writer not in needs:
+                needs = (*needs, writer)
+            writer = name
+        chained[name] = needs
+    return chained
+
+
+def run_stage(name, script, log_dir, env):
+    """Run one stage, writing its output to a log file.
+
+    Returns
+    -------
+    result : `dict`
+        Start and end times relative to the epoch, and the exit code.
+    """
+    with open(REGISTRY_LOCK, "a") as lock:
+        if name in REGISTRY_WRITERS:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        start = time.time()
+        with open(os.path.join(log_dir, f"{name}.log"), "w") as log:
+            returncode = subprocess.run([script, "--stage", name], stdout=log, stderr=subprocess.STDOUT,
+                                        env=env).returncode
+    return {"start": start, "end": time.time(), "exit_code": returncode}
+
+
+@click.command()
+@click.option("-j", "--jobs", default=3, show_default=True, help="Maximum number of concurrent stages.")
+@click.option("--script", default="bin/run_demo.sh", show_default=True, help="Script defining the stages.")
+@click.option("--log-dir", default="stage_logs", show_default=True, help="Directory for the stage logs.")
+@click.option("--skip", default="", help="Comma-separated stages not to run.")
+@click.option("--report", help="Write the stage timings and critical path to this JSON file.")
+def main(jobs, script, log_dir, skip, report):
+    """Run the demo stages concurrently, at most JOBS at a time."""
+    os.makedirs(log_dir, exist_ok=True)
+    skipped = set(skip.split(",")) - {""}
+    unknown = skipped - STAGES.keys()
+    if unknown:
+        raise click.BadParameter(f"Unknown stages {sorted(unknown)}.", param_hint="--skip")
+    # The tests need both the direct and the quantum-backed runs, so are
+    # not run at the end of the bring_home stage.
+    env = dict(os.environ, PIPELINES_CHECK_SEPARATE_TESTS="1")
+    if env.get("PIPELINES_CHECK_PROFILE"):
+        with open(env["PIPELINES_CHECK_PROFILE"], "w"):
+            pass
+
+    results = {}
+    done = set(skipped)
+    pending = {name: needs for name, needs in STAGES.items() if name not in skipped}
+    running = {}
+    failed = []
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            if not failed:
+                for name, needs in list(pending.items()):
+                    writing = name in REGISTRY_WRITERS and not REGISTRY_WRITERS.isdisjoint(running.values())
+                    if len(running) < jobs and done.issuperset(needs) and not writing:
+                        del pending[name]
+                        print(f"[{time.time() - t0:7.1f}s] starting {name}", flush=True)
+                        running[pool.submit(run_stage, name, script, log_dir, env)] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                results[name] = future.result()
+                duration = results[name]["end"] - results[name]["start"]
+                if results[name]["exit_code"]:
+                    failed.append(name)
+                    print(f"[{time.time() - t0:7.1f}s] FAILED {name} after {duration:.1f}s; "
+                          f"see {os.path.join(log_dir, name + '.log')}", flush=True)
+                else:
+                    done.add(name)
+                    print(f"[{time.time() - t0:7.1f}s] finished {name} in {duration:.1f}s", flush=True)
+    wall = time.time() - t0
+
+    durations = {name: result["end"] - result["start"] for name, result in results.items()}
+    graph = {name: needs for name, needs in STAGES.items() if name in results}
+    _, dag_length = critical_path(graph, durations)
+    path, length = critical_path(with_writer_chain(graph, results), durations)
+    print(f"\n{'stage':16s} {'start':>8s} {'duration':>9s}")
+    for name, result in sorted(results.items(), key=lambda item: item[1]["start"]):
+        marker = " *" if name in path else ""
+        print(f"{name:16s} {result['start'] - t0:7.1f}s {durations[name]:8.1f}s{marker}")
+    print(f"\nCritical path (*) with the registry writers in the order they ran: "
+          f"{' -> '.join(path)}, {length:.1f}s")
+    print(f"Bound from the stage dependencies alone: {dag_length:.1f}s")
+    print(f"Wall time {wall:.1f}s with {jobs} concurrent stages; "
+          f"sum of stages {sum(durations.values()):.1f}s.")
+    if failed:
+        print(f"Not run because of failures: {', '.join(pending) or 'none'}")
+
+    if report:
+        with open(report, "w") as fh:
+            json.dump({"jobs": jobs, "wall": wall, "stages": results, "critical_path": path,
+                       "critical_path_length": length, "dependency_bound": dag_length, "failed": failed},
+                      fh, indent=2)
+    sys.exit(int(bool(failed)))
+
+
+if __name__ == "__main__":
+    main()
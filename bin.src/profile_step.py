@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Wall time, CPU time and peak memory of the steps of the demo script.
+
+Each step is run through ``profile_step.py run``, which appends a record of
+the step to a JSON report. Python commands can also be run under cProfile
+or sampled with py-spy. ``profile_step.py summary`` prints the report as a
+table, optionally next to an earlier report.
+"""
+
+import cProfile
+import json
+import os
+import re
+import runpy
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import click
+
+from demo_utils import locked_json
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def step_name(command):
+    """Name a step after its program and subcommand, e.g.
+    ``pipetask run`` or ``butler transfer-from-graph``.
+    """
+    if _is_python(command):
+        command = command[1:]
+    name = os.path.basename(command[0])
+    for arg in command[1:]:
+        if not arg.startswith("-"):
+            if re.fullmatch(r"[a-z][a-z0-9-]*", arg):
+                name += f" {arg}"
+            break
+    return name
+
+
+def _is_python(command):
+    """Return whether a command runs a script with the Python interpreter.
+    """
+    return os.path.basename(command[0]).startswith("python") and len(command) > 1 \
+        and command[1].endswith(".py")
+
+
+def _python_script(program):
+    """Return the path of a Python script on the path, or `None`."""
+    path = shutil.which(program)
+    if path is None:
+        return None
+    with open(path, "rb") as fh:
+        first_line = fh.readline()
+    return path if first_line.startswith(b"#!") and b"python" in first_line else None
+
+
+def profiled_command(command, profiler, output):
+    """Return the command line running a command under a profiler.
+
+    Commands that are not Python scripts are run unchanged.
+    """
+    if profiler == "none":
+        return command, None
+    if _is_python(command):
+        command = command[1:]
+        script = command[0]
+    else:
+        script = _python_script(command[0])
+    if script is None:
+        return command, None
+    if profiler == "cprofile":
+        # Not "python -m cProfile", which exits 0 whatever the script does.
+        output += ".prof"
+        return [sys.executable, os.path.abspath(__file__), "cprofile", "--output", output, "--", script,
+                *command[1:]], output
+    output += ".svg"
+    return ["py-spy", "record", "--subprocesses", "-o", output, "--", sys.executable, script,
+            *command[1:]], output
+
+
+def run_profiled(script, args, output):
+    """Run a Python script under cProfile in this process.
+
+    The profile is written even if the script fails, and the script's exit
+    status is kept.
+
+    Returns
+    -------
+    code : `int`, `str` or `None`
+        The argument of any `SystemExit` raised by the script, to be passed
+        on to `sys.exit`. Other exceptions are raised.
+    """
+    sys.argv = [script, *args]
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(runpy.run_path, script, run_name="__main__")
+    except SystemExit as e:
+        return e.code
+    finally:
+        profiler.dump_stats(output)
+    return 0
+
+
+def run_step(command, profiler="none", profile_dir="."):
+    """Run a command and measure its resource usage.
+
+    Returns
+    -------
+    record : `dict`
+        Command, start time, wall and CPU times in seconds, peak resident
+        set size in bytes of the largest process and exit code.
+    """
+    name = step_name(command)
+    started = datetime.now(timezone.utc)
+    output = os.path.join(profile_dir, re.sub(r"\W+", "_", name) + started.strftime("-%H%M%S%f"))
+    command_line, profile = profiled_command(command, profiler, output)
+    t0 = time.perf_counter()
+    process = subprocess.Popen(command_line)
+    while True:
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            break
+        except KeyboardInterrupt:
+            process.send_signal(signal.SIGINT)
+    wall = time.perf_counter() - t0
+    # Tell Popen that the process has been reaped.
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "name": name,
+        "command": command,
+        "start_utc": started.isoformat(),
+        "wall": wall,
+        "user_cpu": usage.ru_utime,
+        "system_cpu": usage.ru_stime,
+        "peak_rss": usage.ru_maxrss * RSS_UNIT,
+        "exit_code": process.returncode,
+        "profile": profile,
+    }
+
+
+def summarize(steps):
+    """Total the steps of a report by name, in order of first appearance."""
+    totals = {}
+    for step in steps:
+        entry = totals.setdefault(step["name"], {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_rss": 0})
+        entry["calls"] += 1
+        entry["wall"] += step["wall"]
+        entry["cpu"] += step["user_cpu"] + step["system_cpu"]
+        entry["peak_rss"] = max(entry["peak_rss"], step["peak_rss"])
+    return totals
+
+
+@click.group()
+def cli():
+    """Profile the steps of the demo script."""
+
+
+@cli.command(context_settings={"ignore_unknown_options": True})
+@click.option("--report", required=True, help="JSON report to add the step to.")
+@click.option("--profiler", type=click.Choice(["none", "cprofile", "py-spy"]), default="none",
+              show_default=True, help="Profiler to run Python commands under.")
+@click.option("--profile-dir", default=".", show_default=True, help="Directory to write profiles to.")
+@click.argument("command", nargs=-1, required=True, type=click.UNPROCESSED)
+def run(report, profiler, profile_dir, command):
+    """Run COMMAND and add its timing to the report.
+
+    Exits with the exit code of COMMAND.
+    """
+    if profiler == "py-spy" and shutil.which("py-spy") is None:
+        raise click.UsageError("py-spy is not installed.")
+    os.makedirs(profile_dir, exist_ok=True)
+    record = run_step(list(command), profiler=profiler, profile_dir=profile_dir)
+    with locked_json(report, {"steps": []}) as content:
+        content["steps"].append(record)
+    print(f"[profile] {record['name']}: {record['wall']:.2f}s wall, "
+          f"{record['user_cpu'] + record['system_cpu']:.2f}s CPU, {record['peak_rss'] / 2**20:.0f} MiB",
+          file=sys.stderr)
+    sys.exit(record["exit_code"])
+
+
+@cli.command(hidden=True, context_settings={"ignore_unknown_options": True})
+@click.option("--output", required=True, help="File to write the profile to.")
+@click.argument("script")
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def cprofile(output, script, args):
+    """Run SCRIPT with ARGS under cProfile, exiting as the script does."""
+    sys.exit(run_profiled(script, list(args), output))
+
+
+@cli.command()
+@click.argument("report")
+@click.option("--baseline", help="Earlier report to compare the wall times with.")
+def summary(report, baseline):
+    """Print the time and memory used by each step of REPORT."""
+    with open(report) as fh:
+        totals = summarize(json.load(fh)["steps"])
+    previous = {}
+    if baseline:
+        with open(baseline) as fh:
+            previous = summarize(json.load(fh)["steps"])
+
+    header = f"{'step':36s} {'calls':>5s} {'wall':>9s} {'CPU':>9s} {'peak RSS':>10s}"
+    print(header + (f" {'baseline':>9s} {'change':>8s}" if baseline else ""))
+    total_wall = sum(entry["wall"] for entry in totals.values())
+    for name, entry in totals.items():
+        line = (f"{name:36s} {entry['calls']:5d} {entry['wall']:8.2f}s {entry['cpu']:8.2f}s "
+                f"{entry['peak_rss'] / 2**20:6.0f} MiB")
+        if name in previous:
+            before = previous[name]["wall"]
+            line += f" {before:8.2f}s {(entry['wall'] - before) / before * 100 if before else 0:+7.1f}%"
+        print(line)
+    print(f"{'total':36s} {sum(e['calls'] for e in totals.values()):5d} {total_wall:8.2f}s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Per-quantum resource usage of a pipeline run, read from the task
+metadata datasets, and comparison with a stored baseline.
+"""
+
+import csv
+import json
+import sys
+from datetime import datetime
+
+import click
+
+# Per-task summary quantities compared with the baseline.
+SUMMARY_METRICS = ("wall_total", "cpu_total", "peak_rss_max")
+
+QUANTUM_FIELDS = ("task", "data_id", "start_utc", "end_utc", "wall", "cpu", "peak_rss")
+
+
+def _scalar(metadata, key):
+    """Return a metadata value, or `None` if it is missing."""
+    return metadata.getScalar(key) if key in metadata else None
+
+
+def extract_quantum_record(task, data_id, metadata):
+    """Extract the timing and memory usage of one quantum.
+
+    Parameters
+    ----------
+    task : `str`
+        Label of the task.
+    data_id : `dict`
+        Data ID of the quantum.
+    metadata : `lsst.pipe.base.TaskMetadata` or `lsst.daf.base.PropertySet`
+        Task metadata written by the quantum.
+
+    Returns
+    -------
+    record : `dict`
+        Start and end times, wall and CPU time in seconds and peak resident
+        set size in bytes. Quantities missing from the metadata are `None`.
+    """
+    from lsst.pipe.base import TaskMetadata
+
+    if not isinstance(metadata, TaskMetadata):
+        metadata = TaskMetadata.from_metadata(metadata)
+    quantum = metadata["quantum"] if "quantum" in metadata else TaskMetadata()
+
+    start_utc = _scalar(quantum, "startUtc")
+    end_utc = _scalar(quantum, "endUtc")
+    wall = None
+    if start_utc and end_utc:
+        wall = (datetime.fromisoformat(end_utc) - datetime.fromisoformat(start_utc)).total_seconds()
+    start_cpu = _scalar(quantum, "startCpuTime")
+    end_cpu = _scalar(quantum, "endCpuTime")
+    return {
+        "task": task,
+        "data_id": data_id,
+        "start_utc": start_utc,
+        "end_utc": end_utc,
+        "wall": wall,
+        "cpu": end_cpu - start_cpu if start_cpu is not None and end_cpu is not None else None,
+        "peak_rss": _scalar(quantum, "endMaxResidentSetSize"),
+    }
+
+
+def read_run_metrics(butler, collections):
+    """Read every ``*_metadata`` dataset in the given collections.
+
+    Returns
+    -------
+    records : `list` [`dict`]
+        One record per quantum, see `extract_quantum_record`.
+    """
+    records = []
+    for dataset_type in butler.registry.queryDatasetTypes("*_metadata"):
+        task = dataset_type.name.removesuffix("_metadata")
+        refs = butler.registry.queryDatasets(dataset_type, collections=collections, findFirst=True)
+        for ref in refs:
+            metadata = butler.get(ref)
+            records.append(extract_quantum_record(task, dict(ref.dataId.required), metadata))
+    records.sort(key=lambda record: (record["start_utc"] or "", record["task"]))
+    return records
+
+
+def summarize(records):
+    """Aggregate per-quantum records by task.
+
+    Returns
+    -------
+    summary : `dict` [`str`, `dict`]
+        Number of quanta, total wall and CPU time and maximum peak RSS of
+        each task.
+    """
+    summary = {}
+    for record in records:
+        task = summary.setdefault(record["task"], {"n_quanta": 0, "wall_total": 0.0, "cpu_total": 0.0,
+                                                   "peak_rss_max": 0})
+        task["n_quanta"] += 1
+        task["wall_total"] += record["wall"] or 0.0
+        task["cpu_total"] += record["cpu"] or 0.0
+        task["peak_rss_max"] = max(task["peak_rss_max"], record["peak_rss"] or 0)
+    return summary
+
+
+def compare_to_baseline(summary, baseline, rtol, min_seconds=1.0, min_bytes=50 * 2**20):
+    """Compare a run summary with a baseline summary.
+
+    Parameters
+    ----------
+    summary : `dict` [`str`, `dict`]
+        Summary of the current run, from `summarize`.
+    baseline : `dict` [`str`, `dict`]
+        Summary of the baseline run.
+    rtol : `dict` [`str`, `float`]
+        Allowed fractional increase of each summary metric.
+    min_seconds : `float`, optional
+        Increases in time smaller than this are never regressions, so that
+        very short tasks do not fail on timer noise.
+    min_bytes : `int`, optional
+        Increases in memory smaller than this are never regressions.
+
+    Returns
+    -------
+    rows : `list` [`tuple`]
+        ``(task, metric, baseline, current, regressed)`` for every metric of
+        every task present in both summaries.
+    """
+    rows = []
+    for task, current in summary.items():
+        if task not in baseline:
+            continue
+        for metric in SUMMARY_METRICS:
+            old = baseline[task][metric]
+            new = current[metric]
+            slack = min_bytes if metric.startswith("peak_rss") else min_seconds
+            regressed = new > old * (1 + rtol[metric]) and new - old > slack
+            rows.append((task, metric, old, new, regressed))
+    return rows
+
+
+def _format(metric, value):
+    if metric.startswith("peak_rss"):
+        return f"{value / 2**20:.1f} MiB"
+    return f"{value:.2f} s"
+
+
+@click.command()
+@click.argument("repo")
+@click.argument("collections", nargs=-1, required=True)
+@click.option("--json", "json_file", help="Write per-quantum records and the summary to this JSON file.")
+@click.option("--csv", "csv_file", help="Write per-quantum records to this CSV file.")
+@click.option("--baseline", help="Baseline JSON file, written by an earlier run, to compare with.")
+@click.option("--wall-rtol", default=0.25, show_default=True, help="Allowed fractional wall time increase.")
+@click.option("--cpu-rtol", default=0.25, show_default=True, help="Allowed fractional CPU time increase.")
+@click.option("--rss-rtol", default=0.10, show_default=True, help="Allowed fractional peak RSS increase.")
+def main(repo, collections, json_file, csv_file, baseline, wall_rtol, cpu_rtol, rss_rtol):
+    """Benchmark the quanta in COLLECTIONS of REPO from their task metadata.
+
+    The JSON output of one run can be used as the --baseline of a later
+    one. The command exits with a non-zero status if any task got slower or
+    larger than the baseline allows.
+    """
+    from lsst.daf.butler import Butler
+
+    butler = Butler(repo, writeable=False)
+    records = read_run_metrics(butler, list(collections))
+    summary = summarize(records)
+
+    print(f"{'task':30s} {'quanta':>6s} {'wall':>10s} {'cpu':>10s} {'peak rss':>12s}")
+    for task, values in summary.items():
+        print(f"{task:30s} {values['n_quanta']:6d} {values['wall_total']:9.2f}s {values['cpu_total']:9.2f}s "
+              f"{_format('peak_rss', values['peak_rss_max']):>12s}")
+
+    if json_file:
+        with open(json_file, "w") as fh:
+            json.dump({"collections": list(collections), "summary": summary, "quanta": records}, fh, indent=2)
+    if csv_file:
+        with open(csv_file, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=QUANTUM_FIELDS)
+            writer.writeheader()
+            for record in records:
+                writer.writerow(dict(record, data_id=json.dumps(record["data_id"], sort_keys=True)))
+
+    if baseline:
+        with open(baseline) as fh:
+            baseline_summary = json.load(fh)["summary"]
+        rtol = {"wall_total": wall_rtol, "cpu_total": cpu_rtol, "peak_rss_max": rss_rtol}
+        rows = compare_to_baseline(summary, baseline_summary, rtol)
+        print(f"\nComparison with {baseline}:")
+        for task, metric, old, new, regressed in rows:
+            flag = "REGRESSION" if regressed else ""
+            print(f"{task:30s} {metric:14s} {_format(metric, old):>12s} -> "
+                  f"{_format(metric, new):>12s} {flag}")
+        missing = sorted(set(baseline_summary) - set(summary))
+        if missing:
+            print(f"WARNING: tasks in baseline but not in this run: {missing}", file=sys.stderr)
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
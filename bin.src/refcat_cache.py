@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Columnar, memory-mappable copies of the bundled reference catalogs.
+
+Each HTM shard of a reference catalog is a FITS table that has to be read
+in full, with every column, even when only a small area and a handful of
+columns are needed. The cache stores each column of a whole reference
+catalog as a separate ``.npy`` file, with the rows sorted by declination so
+that a sky region maps to a contiguous slice found by binary search.
+"""
+
+import json
+import os
+import re
+import time
+
+import click
+import numpy as np
+
+# Written next to the column files of each reference catalog.
+INDEX_FILE = "index.json"
+
+# Written at the top of the cache, listing the catalogs it holds.
+MANIFEST_FILE = "manifest.json"
+
+# Flux field prefix used to time the standard loader for each bundled
+# catalog, as calibrateImage would for an r-band exposure.
+DEFAULT_FILTERS = {"gaia_dr2_20200414": "phot_g_mean", "ps1_pv3_3pi_20170110": "r"}
+
+
+def _shard_id(filename):
+    """Return the HTM index of a shard file, the last number in its name."""
+    return int(re.findall(r"\d+", os.path.basename(filename))[-1])
+
+
+def build_refcat(shard_files, output_dir):
+    """Convert the HTM shards of one reference catalog to column files.
+
+    Parameters
+    ----------
+    shard_files : `list` [`str`]
+        FITS files of the shards.
+    output_dir : `str`
+        Directory to write the column files and index to.
+
+    Returns
+    -------
+    index : `dict`
+        Content of the index file.
+    """
+    from astropy.io import fits
+
+    columns = {}
+    shards = []
+    header = {}
+    for filename in sorted(shard_files):
+        with fits.open(filename, memmap=False) as hdus:
+            table = hdus[1].data
+            header = {key: value for key, value in hdus[1].header.items() if key.startswith("REFCAT")}
+            for name in table.columns.names:
+                columns.setdefault(name, []).append(np.asarray(table[name]))
+            shards.append({"htm7": _shard_id(filename), "n_rows": len(table),
+                           "file": os.path.basename(filename)})
+        columns.setdefault("htm7", []).append(np.full(shards[-1]["n_rows"], shards[-1]["htm7"],
+                                                      dtype=np.int32))
+
+    merged = {name: np.concatenate(parts) for name, parts in columns.items()}
+    order = np.argsort(merged["coord_dec"], kind="stable")
+    os.makedirs(output_dir, exist_ok=True)
+    for name, values in merged.items():
+        # Native byte order so that loads need no conversion.
+        values = values[order]
+        np.save(os.path.join(output_dir, f"{name}.npy"), values.astype(values.dtype.newbyteorder("=")))
+
+    dec = merged["coord_dec"][order]
+    index = {
+        "n_rows": int(len(order)),
+        "sorted_by": "coord_dec",
+        "dec_range": [float(dec[0]), float(dec[-1])] if len(dec) else None,
+        "columns": sorted(merged),
+        "shards": shards,
+        "header": header,
+    }
+    with open(os.path.join(output_dir, INDEX_FILE), "w") as fh:
+        json.dump(index, fh, indent=2)
+    return index
+
+
+class ColumnarRefcat:
+    """Read-only access to one cached reference catalog.
+
+    Parameters
+    ----------
+    path : `str`
+        Directory written by `build_refcat`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as fh:
+            self.index = json.load(fh)
+        self._columns = {}
+
+    @property
+    def columns(self):
+        """Names of the available columns (`list` [`str`])."""
+        return self.index["columns"]
+
+    def column(self, name):
+        """Return a memory-mapped column."""
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+        return self._columns[name]
+
+    def load_region(self, ra, dec, radius, columns=None):
+        """Load the rows within a circle on the sky.
+
+        Parameters
+        ----------
+        ra, dec : `float`
+            Center of the circle, in radians.
+        radius : `float`
+            Radius of the circle, in radians.
+        columns : `list` [`str`], optional
+            Columns to load; all columns if not given.
+
+        Returns
+        -------
+        rows : `dict` [`str`, `numpy.ndarray`]
+            Values of the requested columns for the rows in the circle.
+        """
+        coord_dec = self.column("coord_dec")
+        start, stop = np.searchsorted(coord_dec, [dec - radius, dec + radius])
+        row_ra = np.asarray(self.column("coord_ra")[start:stop])
+        row_dec = np.asarray(coord_dec[start:stop])
+        # Haversine separation; accurate at all scales.
+        hav = (np.sin((row_dec - dec) / 2) ** 2
+               + np.cos(row_dec) * np.cos(dec) * np.sin((row_ra - ra) / 2) ** 2)
+        selected = 2 * np.arcsin(np.sqrt(np.clip(hav, 0, 1))) <= radius
+        return {name: np.asarray(self.column(name)[start:stop][selected]) for name in columns or self.columns}
+
+
+@click.group()
+def cli():
+    """Build and benchmark columnar reference catalog caches."""
+
+
+@cli.command()
+@click.option("--input", "input_dir", default="input_data/refcats", show_default=True,
+              help="Directory with one subdirectory of FITS shards per reference catalog.")
+@click.option("--output", "output_dir", default="refcat_cache", show_default=True,
+              help="Cache directory to write.")
+def build(input_dir, output_dir):
+    """Convert every reference catalog under --input to columnar form."""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {}
+    for name in sorted(os.listdir(input_dir)):
+        refcat_dir = os.path.join(input_dir, name)
+        shard_files = [os.path.join(refcat_dir, f) for f in os.listdir(refcat_dir) if f.endswith(".fits")]
+        if not shard_files:
+            continue
+        t0 = time.perf_counter()
+        index = build_refcat(shard_files, os.path.join(output_dir, name))
+        manifest[name] = {"path": name, "n_rows": index["n_rows"],
+                          "shards": [shard["htm7"] for shard in index["shards"]]}
+        print(f"{name}: {index['n_rows']} rows from {len(shard_files)} shards, "
+              f"{len(index['columns'])} columns in {time.perf_counter() - t0:.2f}s")
+    if not manifest:
+        raise click.ClickException(f"No reference catalog shards found under {input_dir}.")
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as fh:
+        json.dump(manifest, fh, indent=2)
+
+
+@cli.command()
+@click.argument("repo")
+@click.option("--cache", "cache_dir", default="refcat_cache", show_default=True, help="Cache directory.")
+@click.option("--visit", default=903342, show_default=True, help="Visit whose detector region is loaded.")
+@click.option("--detector", default=10, show_default=True, help="Detector whose region is loaded.")
+@click.option("--columns", default="id,coord_ra,coord_dec", show_default=True,
+              help="Comma-separated columns to load from the cache, in addition to the flux columns.")
+@click.option("--repeats", default=5, show_default=True, help="Number of timed loads of each kind.")
+def bench(repo, cache_dir, visit, detector, columns, repeats):
+    """Compare the standard reference catalog loader with the cache.
+
+    The standard loader reads the shards through the butler from REPO, as
+    calibrateImage does, and trims them to the detector region. The cache
+    is opened and loads only the requested columns of the rows in the
+    bounding circle of the same region, which are then trimmed to the
+    region as well. Both timings cover everything from an unopened catalog
+    to the rows in the region; they differ in the columns loaded.
+    """
+    from lsst.daf.butler import Butler
+    from lsst.meas.algorithms import LoadReferenceObjectsConfig, ReferenceObjectLoader
+    from lsst.sphgeom import LonLat
+
+    butler = Butler(repo, writeable=False)
+    (record,) = butler.registry.queryDimensionRecords("visit_detector_region", instrument="HSC",
+                                                      visit=visit, detector=detector)
+    region = record.region
+    circle = region.getBoundingCircle()
+    center = LonLat(circle.getCenter())
+    radius = circle.getOpeningAngle().asRadians()
+
+    with open(os.path.join(cache_dir, MANIFEST_FILE)) as fh:
+        manifest = json.load(fh)
+    for name, entry in manifest.items():
+        filter_name = DEFAULT_FILTERS.get(name, "r")
+        refs = list(butler.registry.queryDatasets(name, collections="refcats"))
+        wanted = columns.split(",") + [f"{filter_name}_flux", f"{filter_name}_fluxErr"]
+
+        before = []
+        for _ in range(repeats):
+            loader = ReferenceObjectLoader(
+                dataIds=[ref.dataId for ref in refs],
+                refCats=[butler.getDeferred(ref) for ref in refs],
+                name=name,
+                config=LoadReferenceObjectsConfig(),
+            )
+            t0 = time.perf_counter()
+            n_before = len(loader.loadRegion(region, filter_name).refCat)
+            before.append(time.perf_counter() - t0)
+
+        after = []
+        for _ in range(repeats):
+            # Opening the index and memory-mapping the columns is part of
+            # the load, as reading the shards is for the standard loader.
+            t0 = time.perf_counter()
+            cached = ColumnarRefcat(os.path.join(cache_dir, entry["path"]))
+            rows = cached.load_region(center.getLon().asRadians(), center.getLat().asRadians(), radius,
+                                      wanted)
+            n_after = int(np.count_nonzero(region.contains(rows["coord_ra"], rows["coord_dec"])))
+            after.append(time.perf_counter() - t0)
+
+        if n_after != n_before:
+            print(f"WARNING: {name}: the loader found {n_before} rows in the region and the cache "
+                  f"{n_after}.")
+        print(f"{name}: loader {min(before) * 1000:.1f} ms ({n_before} rows in region, all columns), "
+              f"cache {min(after) * 1000:.1f} ms ({n_after} rows in region, "
+              f"{len(wanted)} of {len(cached.columns)} columns)")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""SQLite registry tuning for throwaway repositories, and a benchmark of
+registry latency for different repository locations and settings.
+
+The middleware makes many small registry transactions, each of which SQLite
+makes durable with an fsync of its journal. On shared file systems those
+dominate. ``wal`` switches a repository's registry to write-ahead logging,
+under which a commit appends to one log file and readers do not block the
+writer. ``bench`` creates scratch repositories in the default layout and on
+tmpfs with write-ahead logging and times the same small operations in each.
+"""
+
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import click
+
+# Registry file of a repository created with the default configuration.
+REGISTRY_FILE = "gen3.sqlite3"
+
+DEFAULT_TMPFS = "/dev/shm"
+
+
+def set_journal_mode(repo, mode="wal"):
+    """Set the journal mode of a repository's SQLite registry.
+
+    The journal mode is stored in the database file, so it applies to every
+    later connection made by the middleware.
+
+    Returns
+    -------
+    mode : `str`
+        The journal mode now in effect.
+    """
+    path = os.path.join(repo, REGISTRY_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No SQLite registry at {path}.")
+    with sqlite3.connect(path) as connection:
+        (result,) = connection.execute(f"PRAGMA journal_mode={mode}").fetchone()
+    return result
+
+
+def _latencies(func, n):
+    """Call a function ``n`` times with the iteration number and return the
+    duration of each call in seconds.
+    """
+    samples = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def time_registry(root, seed_config, n, wal):
+    """Create a repository and time small registry and datastore operations.
+
+    Every operation is its own transaction, as in ``pipetask`` and the
+    transfer commands.
+
+    Returns
+    -------
+    latencies : `dict` [`str`, `list` [`float`]]
+        Duration in seconds of each call of each operation.
+    """
+    from lsst.daf.butler import Butler, DatasetType
+
+    t0 = time.perf_counter()
+    Butler.makeRepo(root, config=seed_config)
+    if wal:
+        set_journal_mode(root)
+    butler = Butler(root, writeable=True, run="bench")
+    latencies = {"create": [time.perf_counter() - t0]}
+    registry = butler.registry
+    registry.insertDimensionData("instrument", {"name": "Bench", "detector_max": n, "visit_max": 1,
+                                                "exposure_max": 1})
+    dataset_type = DatasetType("bench", ["instrument", "detector"], "StructuredDataDict",
+                               universe=butler.dimensions)
+    registry.registerDatasetType(dataset_type)
+
+    latencies["insert"] = _latencies(
+        lambda i: registry.insertDimensionData("detector", {"instrument": "Bench", "id": i,
+                                                            "full_name": f"B{i}"}),
+        n,
+    )
+    refs = []
+    latencies["put"] = _latencies(
+        lambda i: refs.append(butler.put({"detector": i}, dataset_type, instrument="Bench", detector=i)),
+        n,
+    )
+    latencies["query"] = _latencies(
+        lambda i: list(registry.queryDatasets(dataset_type, collections="bench",
+                                              where="instrument = 'Bench' AND detector = d", bind={"d": i})),
+        n,
+    )
+    latencies["get"] = _latencies(lambda i: butler.get(refs[i]), n)
+    return latencies
+
+
+@click.group()
+def cli():
+    """Tune and benchmark SQLite registries."""
+
+
+@cli.command()
+@click.argument("repo")
+def wal(repo):
+    """Switch the registry of REPO to write-ahead logging."""
+    print(f"{repo}: journal mode {set_journal_mode(repo)}")
+
+
+@cli.command()
+@click.option("--disk-dir", default=".", show_default=True,
+              help="Directory for the repository in the default layout.")
+@click.option("--tmpfs-dir", default=DEFAULT_TMPFS, show_default=True,
+              help="tmpfs directory for the throwaway repository.")
+@click.option("--seed-config", default="configs/butler-seed.yaml", show_default=True,
+              help="Seed configuration of the default layout.")
+@click.option("--tmpfs-seed-config", default="configs/butler-seed-tmpfs.yaml", show_default=True,
+              help="Seed configuration of the throwaway repository.")
+@click.option("-n", "--repeats", default=200, show_default=True, help="Number of calls of each operation.")
+def bench(disk_dir, tmpfs_dir, seed_config, tmpfs_seed_config, repeats):
+    """Compare registry latencies of a repository in the default layout
+    with a throwaway repository on tmpfs.
+    """
+    layouts = {
+        "default": (disk_dir, seed_config, False),
+        "tmpfs+wal": (tmpfs_dir, tmpfs_seed_config, True),
+    }
+    results = {}
+    for name, (parent, config, use_wal) in layouts.items():
+        with tempfile.TemporaryDirectory(dir=parent, prefix="registry_latency-") as scratch:
+            results[name] = time_registry(os.path.join(scratch, "repo"), os.path.abspath(config), repeats,
+                                          use_wal)
+
+    print(f"{'operation':10s} " + " ".join(f"{name + ' median':>18s} {'p95':>9s}" for name in results))
+    for operation in results["default"]:
+        line = f"{operation:10s}"
+        for latencies in results.values():
+            samples = sorted(latencies[operation])
+            p95 = samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+            line += f" {statistics.median(samples) * 1000:16.2f}ms {p95 * 1000:7.2f}ms"
+        print(line)
+    print(f"{repeats} calls of each operation; create is a single call.")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Execute every quantum of a graph with quantum-backed butlers from a
+single driver process.
+
+This is the in-process equivalent of running ``pipetask pre-exec-init-qbb``
+followed by one ``pipetask run-qbb --qgraph-node-id`` per quantum. The graph
+is loaded once, quanta are grouped by dependency level and each level is run
+on a pool of forked workers that inherit the loaded graph.
+"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Set in the parent before the pool is created so that forked workers
+# inherit them instead of loading the graph again.
+_GRAPH = None
+_BUTLER_FACTORY = None
+
+
+class _TimedQBBFactory:
+    """Create a `QuantumBackedButler` for each quantum, recording how long
+    the butler took to initialize.
+
+    Parameters
+    ----------
+    butler_config : `str`
+        Butler configuration used to create the quantum-backed butlers.
+    universe : `lsst.daf.butler.DimensionUniverse`
+        Dimension universe of the graph.
+    dataset_types : `dict` [`str`, `lsst.daf.butler.DatasetType`]
+        Dataset types used by the graph.
+    """
+
+    def __init__(self, butler_config, universe, dataset_types):
+        self.butler_config = butler_config
+        self.universe = universe
+        self.dataset_types = dataset_types
+        self.elapsed = 0.0
+
+    def __call__(self, quantum):
+        from lsst.daf.butler import QuantumBackedButler
+
+        t0 = time.perf_counter()
+        butler = QuantumBackedButler.initialize(
+            config=self.butler_config,
+            quantum=quantum,
+            dimensions=self.universe,
+            dataset_types=self.dataset_types,
+        )
+        self.elapsed += time.perf_counter() - t0
+        return butler
+
+
+def _execute_node(node_id):
+    """Execute a single quantum in a worker process and return its timing
+    record.
+    """
+    from lsst.ctrl.mpexec import SingleQuantumExecutor, TaskFactory
+
+    node = _GRAPH.getQuantumNodeByNodeId(node_id)
+    _BUTLER_FACTORY.elapsed = 0.0
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    executor = SingleQuantumExecutor(
+        None,
+        TaskFactory(),
+        assumeNoExistingOutputs=True,
+        raise_on_partial_outputs=True,
+        limited_butler_factory=_BUTLER_FACTORY,
+    )
+    error = None
+    try:
+        executor.execute(node.task_node, node.quantum, node.nodeId)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - t0
+    return {
+        "node_id": str(node_id),
+        "task": node.task_node.label,
+        "butler_init": _BUTLER_FACTORY.elapsed,
+        "execute": wall - _BUTLER_FACTORY.elapsed,
+        "wall": wall,
+        "cpu": time.process_time() - cpu0,
+        "error": error,
+    }
+
+
+def init_logging(longlog=True):
+    """Configure logging as ``pipetask --long-log`` does.
+
+    The log datasets written for each quantum capture only the records that
+    the logging configuration lets through, so they match those of a
+    ``pipetask`` run only if lsst loggers are at INFO here too. Forked
+    workers inherit the configuration.
+    """
+    from lsst.daf.butler.cli.cliLog import CliLog
+
+    CliLog.initLog(longlog=longlog)
+    CliLog.setLogLevels([(None, "INFO")])
+
+
+def run_graph(butler_config, graph_uri, processes=1, pre_exec_init=True):
+    """Load a quantum graph once and execute all of its quanta.
+
+    Parameters
+    ----------
+    butler_config : `str`
+        Butler configuration, usually the ``butler.yaml`` of the repository.
+    graph_uri : `str`
+        Location of the saved quantum graph.
+    processes : `int`, optional
+        Number of worker processes used to run independent quanta.
+    pre_exec_init : `bool`, optional
+        Whether to save init-outputs, configs and package versions first, as
+        ``pipetask pre-exec-init-qbb`` does.
+
+    Returns
+    -------
+    report : `dict`
+        One-off startup costs and a timing record for every quantum.
+    """
+    global _GRAPH, _BUTLER_FACTORY
+
+    startup = {}
+    t0 = time.perf_counter()
+    import networkx
+    from lsst.ctrl.mpexec import PreExecInitLimited, TaskFactory
+    from lsst.pipe.base import QuantumGraph
+    startup["import"] = time.perf_counter() - t0
+
+    init_logging()
+
+    t0 = time.perf_counter()
+    _GRAPH = QuantumGraph.loadUri(graph_uri)
+    startup["graph_load"] = time.perf_counter() - t0
+
+    if pre_exec_init:
+        t0 = time.perf_counter()
+        PreExecInitLimited(_GRAPH.make_init_qbb(butler_config), TaskFactory()).initialize(_GRAPH)
+        startup["pre_exec_init"] = time.perf_counter() - t0
+
+    dataset_types = {dstype.name: dstype for dstype in _GRAPH.registryDatasetTypes()}
+    _BUTLER_FACTORY = _TimedQBBFactory(butler_config, _GRAPH.universe, dataset_types)
+
+    # Quanta in the same generation have no dependencies on each other.
+    levels = [[node.nodeId for node in level] for level in networkx.topological_generations(_GRAPH.graph)]
+
+    quanta = []
+    t0 = time.perf_counter()
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        for level, node_ids in enumerate(levels):
+            records = list(pool.map(_execute_node, node_ids))
+            for record in records:
+                record["level"] = level
+            quanta.extend(records)
+            if any(record["error"] for record in records):
+                # Everything downstream depends on this level.
+                break
+    execution = time.perf_counter() - t0
+
+    return {
+        "graph": graph_uri,
+        "processes": processes,
+        "n_quanta": len(_GRAPH),
+        "n_levels": len(levels),
+        "startup": startup,
+        "execution": execution,
+        "quanta": quanta,
+    }
+
+
+def _print_summary(report):
+    """Print startup and per-quantum timings as a table."""
+    for name, seconds in report["startup"].items():
+        print(f"{name:>16s}: {seconds:8.2f}s")
+    print(f"{'execution':>16s}: {report['execution']:8.2f}s "
+          f"({report['n_quanta']} quanta in {report['n_levels']} levels, {report['processes']} processes)")
+    print(f"{'level':>5s} {'task':30s} {'butler init':>12s} {'execute':>10s} {'cpu':>10s}")
+    for record in report["quanta"]:
+        status = f"  FAILED: {record['error']}" if record["error"] else ""
+        print(f"{record['level']:5d} {record['task']:30s} {record['butler_init']:11.2f}s "
+              f"{record['execute']:9.2f}s {record['cpu']:9.2f}s{status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run all quanta of a graph through quantum-backed butlers from one process."
+    )
+    parser.add_argument("butler_config", help="Butler configuration, e.g. DATA_REPO/butler.yaml")
+    parser.add_argument("graph", help="Quantum graph file")
+    parser.add_argument("-j", "--processes", type=int, default=1,
+                        help="Number of worker processes for independent quanta")
+    parser.add_argument("--skip-pre-exec-init", action="store_true",
+                        help="Do not save init-outputs; pre-exec-init-qbb has already been run")
+    parser.add_argument("--report", help="Write the timing report to this JSON file")
+    args = parser.parse_args()
+
+    report = run_graph(args.butler_config, args.graph, processes=args.processes,
+                       pre_exec_init=not args.skip_pre_exec_init)
+    _print_summary(report)
+    if args.report:
+        with open(args.report, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+    failed = [record for record in report["quanta"] if record["error"]]
+    skipped = report["n_quanta"] - len(report["quanta"])
+    if failed or skipped:
+        print(f"ERROR: {len(failed)} quanta failed, {skipped} not attempted.", file=sys.stderr)
+        sys.exit(1)
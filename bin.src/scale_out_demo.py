@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Replicate the single demo CCD across synthetic visits and detectors and
+measure how quantum graph generation, execution and registry queries scale.
+
+The synthetic raws and calibrations are hardlinks to the bundled files and
+keep their original headers, so the outputs are not scientifically
+meaningful; only the middleware load is.
+"""
+
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import time
+
+import click
+
+from seed_repo_cache import clone_tree
+
+INSTRUMENT = "HSC"
+TEMPLATE_EXPOSURE = 903342
+TEMPLATE_DETECTOR = 10
+RAW_RUN = "HSC/raw/all"
+CALIB_COLLECTION = "HSC/calib"
+INPUT_COLLECTION = "HSC/defaults"
+
+# Synthetic exposure and visit IDs start here; well above any real HSC
+# exposure and below the instrument's exposure_max.
+SYNTHETIC_ID_START = 20_000_000
+
+# Visit dimension elements whose records are copied for each synthetic
+# visit, if the dimension universe has them.
+VISIT_ELEMENTS = ("visit", "visit_definition", "visit_detector_region", "visit_system_membership")
+
+
+def _replace_record(record, **changes):
+    """Return a copy of a dimension record as a `dict` with some fields
+    replaced, ignoring fields the record does not have.
+    """
+    values = record.toDict()
+    values.update({key: value for key, value in changes.items() if key in values})
+    return values
+
+
+def _pick_detectors(registry, n_detectors):
+    """Return the template detector followed by other science detectors."""
+    others = sorted(
+        record.id
+        for record in registry.queryDimensionRecords("detector", instrument=INSTRUMENT)
+        if record.purpose == "SCIENCE" and record.id != TEMPLATE_DETECTOR
+    )
+    if n_detectors - 1 > len(others):
+        raise ValueError(f"{INSTRUMENT} has only {len(others) + 1} science detectors.")
+    return [TEMPLATE_DETECTOR] + others[:n_detectors - 1]
+
+
+def clone_calibrations(butler, detectors):
+    """Certify hardlinked copies of the template detector's calibrations for
+    other detectors.
+    """
+    from lsst.daf.butler import DatasetRef, FileDataset
+
+    registry = butler.registry
+    for dataset_type in registry.queryDatasetTypes(...):
+        if not dataset_type.isCalibration() or "detector" not in dataset_type.dimensions.names:
+            continue
+        associations = registry.queryDatasetAssociations(
+            dataset_type, collections=CALIB_COLLECTION, flattenChains=True
+        )
+        for association in associations:
+            ref = association.ref
+            if ref.dataId["detector"] != TEMPLATE_DETECTOR:
+                continue
+            path = butler.getURI(ref).ospath
+            new_refs = []
+            for detector in detectors[1:]:
+                data_id = dict(ref.dataId.required, detector=detector)
+                new_ref = DatasetRef(dataset_type, registry.expandDataId(data_id), run=ref.run)
+                butler.ingest(FileDataset(path=path, refs=[new_ref]), transfer="hardlink")
+                new_refs.append(new_ref)
+            registry.certify(CALIB_COLLECTION, new_refs, association.timespan)
+
+
+def add_synthetic_ccds(butler, n_visits, detectors):
+    """Add synthetic exposures, visits and raws to a repository.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Writeable butler for a seeded repository containing the template
+        exposure.
+    n_visits : `int`
+        Total number of visits wanted, including the template visit.
+    detectors : `list` [`int`]
+        Detectors each visit should have, starting with the template.
+
+    Returns
+    -------
+    exposures : `list` [`int`]
+        IDs of all the exposures, including the template.
+    """
+    from lsst.daf.butler import DatasetRef, FileDataset
+    from lsst.pipe.base import Instrument
+
+    registry = butler.registry
+    instrument = Instrument.from_string(INSTRUMENT, registry)
+    template_id = {"instrument": INSTRUMENT, "exposure": TEMPLATE_EXPOSURE, "detector": TEMPLATE_DETECTOR}
+    raw_ref = butler.find_dataset("raw", template_id, collections=RAW_RUN)
+    raw_path = butler.getURI(raw_ref).ospath
+    formatter = instrument.getRawFormatter(raw_ref.dataId)
+
+    (exposure,) = registry.queryDimensionRecords("exposure", instrument=INSTRUMENT,
+                                                 exposure=TEMPLATE_EXPOSURE)
+    visit_records = {
+        element: list(registry.queryDimensionRecords(element, instrument=INSTRUMENT,
+                                                     visit=TEMPLATE_EXPOSURE))
+        for element in VISIT_ELEMENTS
+        if element in registry.dimensions.elements.names
+    }
+
+    exposures = [TEMPLATE_EXPOSURE]
+    with butler.transaction():
+        for index in range(1, n_visits):
+            new_id = SYNTHETIC_ID_START + index
+            obs_id = f"SYNTH{new_id:08d}"
+            registry.insertDimensionData("exposure", _replace_record(exposure, id=new_id, obs_id=obs_id))
+            for element, records in visit_records.items():
+                if element != "visit_detector_region":
+                    registry.insertDimensionData(element, *[
+                        _replace_record(record, id=new_id, name=obs_id, visit=new_id, exposure=new_id)
+                        for record in records
+                    ])
+            exposures.append(new_id)
+
+        # Every detector of every visit needs a region, including the extra
+        # detectors of the template visit.
+        (region,) = [record for record in visit_records.get("visit_detector_region", [])
+                     if record.detector == TEMPLATE_DETECTOR] or [None]
+        datasets = []
+        for exposure_id in exposures:
+            for detector in detectors:
+                if (exposure_id, detector) == (TEMPLATE_EXPOSURE, TEMPLATE_DETECTOR):
+                    continue
+                if region is not None:
+                    registry.insertDimensionData(
+                        "visit_detector_region", _replace_record(region, visit=exposure_id, detector=detector)
+                    )
+                data_id = registry.expandDataId(instrument=INSTRUMENT, exposure=exposure_id,
+                                                detector=detector)
+                ref = DatasetRef(raw_ref.datasetType, data_id, run=RAW_RUN)
+                datasets.append(FileDataset(path=raw_path, refs=[ref], formatter=formatter))
+        if datasets:
+            butler.ingest(*datasets, transfer="hardlink")
+
+    if len(detectors) > 1:
+        clone_calibrations(butler, detectors)
+    return exposures
+
+
+def time_registry_queries(butler, output_run, repeats=3):
+    """Return the median latency of some typical registry queries."""
+    from lsst.daf.butler import MissingCollectionError
+
+    registry = butler.registry
+    queries = {
+        "raw_datasets": lambda: list(registry.queryDatasets("raw", collections=RAW_RUN)),
+        "visit_detector_data_ids": lambda: list(registry.queryDataIds(["visit", "detector"], datasets="raw",
+                                                                      collections=RAW_RUN)),
+        "calib_lookup": lambda: list(registry.queryDatasets("bias", collections=CALIB_COLLECTION,
+                                                            findFirst=False)),
+    }
+    try:
+        registry.getCollectionType(output_run)
+    except MissingCollectionError:
+        # Nothing was executed (--no-execute).
+        pass
+    else:
+        queries["output_datasets"] = lambda: list(registry.queryDatasets(..., collections=output_run))
+    latencies = {}
+    for name, query in queries.items():
+        samples = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            query()
+            samples.append(time.perf_counter() - t0)
+        latencies[name] = statistics.median(samples)
+    return latencies
+
+
+def run_size(base_repo, workdir, n_visits, n_detectors, pipeline, jobs, execute):
+    """Build a repository with ``n_visits * n_detectors`` CCDs and time the
+    pipeline on it.
+    """
+    from lsst.daf.butler import Butler
+    from lsst.pipe.base import QuantumGraph
+
+    repo = os.path.join(workdir, f"repo_{n_visits}x{n_detectors}")
+    graph_file = os.path.join(workdir, f"scale_{n_visits}x{n_detectors}.qg")
+    output_run = f"scale_out/{n_visits}x{n_detectors}"
+    if os.path.exists(repo):
+        shutil.rmtree(repo)
+    result = {"n_visits": n_visits, "n_detectors": n_detectors, "n_ccds": n_visits * n_detectors}
+
+    t0 = time.perf_counter()
+    clone_tree(base_repo, repo)
+    butler = Butler(repo, writeable=True)
+    detectors = _pick_detectors(butler.registry, n_detectors)
+    exposures = add_synthetic_ccds(butler, n_visits, detectors)
+    result["setup"] = time.perf_counter() - t0
+
+    where = (f"instrument='{INSTRUMENT}' AND exposure IN ({', '.join(str(e) for e in exposures)}) "
+             f"AND detector IN ({', '.join(str(d) for d in detectors)})")
+    common = ["-b", repo, "--input", INPUT_COLLECTION, "-p", pipeline,
+              "--instrument", "lsst.obs.subaru.HyperSuprimeCam", "--output-run", output_run]
+    t0 = time.perf_counter()
+    subprocess.run(["pipetask", "qgraph", "-d", where, "-q", graph_file] + common, check=True)
+    result["qgraph_build"] = time.perf_counter() - t0
+    result["n_quanta"] = len(QuantumGraph.loadUri(graph_file))
+
+    if execute:
+        t0 = time.perf_counter()
+        subprocess.run(["pipetask", "run", "-g", graph_file, "-j", str(jobs), "--register-dataset-types"]
+                       + common, check=True)
+        result["execution"] = time.perf_counter() - t0
+        result["quanta_per_second"] = result["n_quanta"] / result["execution"]
+
+    result["registry_query_latency"] = time_registry_queries(Butler(repo, writeable=False), output_run)
+    return result
+
+
+@click.command()
+@click.argument("base_repo")
+@click.option("--sizes", default="1,4,16", show_default=True,
+              help="Comma-separated numbers of visits to generate.")
+@click.option("--detectors", "n_detectors", default=1, show_default=True,
+              help="Number of detectors per visit. Detectors other than the template get hardlinked copies "
+                   "of its calibrations.")
+@click.option("--pipeline", default=lambda: os.path.join(os.environ.get("DRP_PIPE_DIR", ""), "pipelines",
+                                                         "HSC", "pipelines_check.yaml"),
+              show_default="$DRP_PIPE_DIR/pipelines/HSC/pipelines_check.yaml", help="Pipeline to run.")
+@click.option("-j", "--jobs", default=1, show_default=True, help="Number of processes for pipetask run.")
+@click.option("--workdir", default="scale_out", show_default=True,
+              help="Directory for the synthetic repositories and graphs.")
+@click.option("--no-execute", is_flag=True, help="Only build the quantum graphs.")
+@click.option("--report", default="scale_out.json", show_default=True, help="JSON report file.")
+def main(base_repo, sizes, n_detectors, pipeline, jobs, workdir, no_execute, report):
+    """Measure pipeline scaling with synthetic copies of the demo CCD.
+
+    BASE_REPO must be a seeded repository with the raws ingested and visits
+    defined, such as DATA_REPO after run_demo.sh. It is cloned for each size
+    and never modified.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    for n_visits in (int(size) for size in sizes.split(",")):
+        result = run_size(base_repo, workdir, n_visits, n_detectors, pipeline, jobs, not no_execute)
+        results.append(result)
+        with open(report, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+    print(f"{'ccds':>6s} {'quanta':>7s} {'setup':>9s} {'qgraph':>9s} {'execute':>9s} {'quanta/s':>9s}  "
+          "median registry query latency")
+    for result in results:
+        execution = f"{result['execution']:8.1f}s" if "execution" in result else f"{'-':>9s}"
+        rate = f"{result['quanta_per_second']:9.2f}" if "quanta_per_second" in result else f"{'-':>9s}"
+        latency = ", ".join(f"{name}={seconds * 1000:.1f}ms"
+                            for name, seconds in result["registry_query_latency"].items())
+        print(f"{result['n_ccds']:6d} {result['n_quanta']:7d} {result['setup']:8.1f}s "
+              f"{result['qgraph_build']:8.1f}s {execution} {rate}  {latency}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cache of fully seeded demo data repositories.
+
+A seeded repository is created, has the instrument registered, the
+``input_data`` export imported and the raws ingested. That depends only on
+the seed configuration, the exported registry, the input files, the seed
+steps and the scripts they run, and the installed middleware, so a
+repository seeded once can be cloned for every later run with the same
+inputs.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from demo_utils import file_digest
+
+# Files that are modified in place after seeding and so must never be
+# shared with the cache through a hardlink.
+MUTABLE_SUFFIXES = (".sqlite3", ".sqlite3-journal", ".sqlite3-wal", ".sqlite3-shm", ".yaml")
+
+# EUPS products whose versions determine the registry schema and the
+# content of the seeded repository.
+VERSIONED_PRODUCTS = ("daf_butler", "obs_base", "obs_subaru")
+
+# Scripts, next to this one, that the seed steps of the demo script may run.
+SEED_SCRIPTS = ("calib_compression.py", "fast_import.py", "ingest_raws.py", "registry_latency.py")
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pipelines_check", "repos")
+
+
+def compute_key(seed_config, input_dir, cache_dir, variant="", seed_steps=""):
+    """Compute the cache key for a seeded repository.
+
+    Parameters
+    ----------
+    seed_config : `str`
+        Seed configuration passed to ``butler create``.
+    input_dir : `str`
+        The ``input_data`` directory holding ``export.yaml`` and the files
+        that are imported and ingested.
+    cache_dir : `str`
+        Cache directory, used to remember file digests between runs.
+    variant : `str`, optional
+        Description of any run options that change how the repository is
+        seeded.
+    seed_steps : `str`, optional
+        Shell code of the steps that seed the repository.
+
+    Returns
+    -------
+    key : `str`
+        Hex digest identifying the seeded repository content.
+    """
+    stamps_file = os.path.join(cache_dir, "digests.json")
+    try:
+        with open(stamps_file) as fh:
+            stamps = json.load(fh)
+    except FileNotFoundError:
+        stamps = {}
+
+    key = hashlib.sha256()
+    # Raws are ingested with "direct" transfer, so the absolute location of
+    # the inputs ends up in the registry.
+    input_dir = os.path.abspath(input_dir)
+    key.update(input_dir.encode())
+    key.update(variant.encode())
+    key.update(seed_steps.encode())
+    key.update(file_digest(os.path.abspath(seed_config), stamps).encode())
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    for script in SEED_SCRIPTS:
+        key.update(file_digest(os.path.join(script_dir, script), stamps).encode())
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            key.update(os.path.relpath(path, input_dir).encode())
+            key.update(file_digest(path, stamps).encode())
+    for product in VERSIONED_PRODUCTS:
+        key.update(os.environ.get(f"SETUP_{product.upper()}", "").encode())
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=cache_dir, delete=False) as fh:
+        json.dump(stamps, fh)
+    os.replace(fh.name, stamps_file)
+    return key.hexdigest()
+
+
+def clone_tree(source, destination, method="hardlink"):
+    """Clone a repository directory.
+
+    Parameters
+    ----------
+    source : `str`
+        Directory to clone.
+    destination : `str`
+        New directory to create.
+    method : `str`, optional
+        ``hardlink`` links immutable datastore files and copies the registry
+        and configuration files, ``reflink`` makes a copy-on-write clone
+        (falling back to a copy on file systems that do not support it) and
+        ``copy`` copies everything.
+
+    Notes
+    -----
+    A symbolic link to a repository, as made by ``run_demo.sh`` for one on
+    tmpfs, is followed, so the clone never shares the repository itself.
+    """
+    source = os.path.realpath(source)
+    if method == "reflink":
+        subprocess.run(["cp", "-a", "--reflink=auto", source, destination], check=True)
+        return
+
+    def link_or_copy(src, dst):
+        if method == "hardlink" and not src.endswith(MUTABLE_SUFFIXES):
+            try:
+                os.link(src, dst)
+                return dst
+            except OSError:
+                # Most likely a different file system.
+                pass
+        return shutil.copy2(src, dst)
+
+    shutil.copytree(source, destination, symlinks=True, copy_function=link_or_copy)
+
+
+@click.group()
+@click.option("--cache-dir", default=lambda: os.environ.get("PIPELINES_CHECK_REPO_CACHE", DEFAULT_CACHE_DIR),
+              show_default="$PIPELINES_CHECK_REPO_CACHE or ~/.cache/pipelines_check/repos",
+              help="Directory holding the cached repositories.")
+@click.option("--seed-config", default="configs/butler-seed.yaml", show_default=True,
+              help="Seed configuration used to create the repository.")
+@click.option("--input-dir", default="input_data", show_default=True,
+              help="Directory with export.yaml and the input files.")
+@click.option("--variant", default="", help="Seeding options that change the repository content.")
+@click.option("--seed-steps", default="", help="Shell code of the steps that seed the repository.")
+@click.pass_context
+def cli(ctx, cache_dir, seed_config, input_dir, variant, seed_steps):
+    """Save and restore seeded demo repositories."""
+    t0 = time.perf_counter()
+    key = compute_key(seed_config, input_dir, cache_dir, variant=variant, seed_steps=seed_steps)
+    ctx.obj = {"entry": os.path.join(cache_dir, key), "key": key, "hash_time": time.perf_counter() - t0}
+
+
+@cli.command()
+@click.pass_obj
+def key(obj):
+    """Print the cache key of the current inputs."""
+    print(obj["key"])
+
+
+@cli.command()
+@click.argument("repo")
+@click.option("--method", type=click.Choice(["hardlink", "reflink", "copy"]), default="hardlink",
+              show_default=True, help="How to clone the cached repository.")
+@click.pass_obj
+def restore(obj, repo, method):
+    """Clone the cached repository to REPO.
+
+    Exits with status 1 if there is no cached repository for the current
+    inputs.
+    """
+    if not os.path.isdir(obj["entry"]):
+        print(f"No cached repository for key {obj['key']}.", file=sys.stderr)
+        sys.exit(1)
+    t0 = time.perf_counter()
+    try:
+        clone_tree(obj["entry"], repo, method=method)
+    except BaseException:
+        shutil.rmtree(repo, ignore_errors=True)
+        raise
+    print(f"Restored {repo} from {obj['entry']} by {method} in {time.perf_counter() - t0:.2f}s "
+          f"(input hashing {obj['hash_time']:.2f}s).")
+
+
+@cli.command()
+@click.argument("repo")
+@click.pass_obj
+def save(obj, repo):
+    """Save the freshly seeded repository REPO to the cache."""
+    if os.path.isdir(obj["entry"]):
+        print(f"Repository for key {obj['key']} is already cached.")
+        return
+    t0 = time.perf_counter()
+    # Clone next to the final location and rename so that a concurrent or
+    # interrupted run never sees a partial entry.
+    staging = tempfile.mkdtemp(dir=os.path.dirname(obj["entry"]), prefix="tmp-")
+    try:
+        clone_tree(repo, os.path.join(staging, "repo"))
+        os.rename(os.path.join(staging, "repo"), obj["entry"])
+    except OSError:
+        if not os.path.isdir(obj["entry"]):
+            raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    print(f"Saved {repo} to {obj['entry']} in {time.perf_counter() - t0:.2f}s.")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Manifest of the stages of the demo script that have run, so that a later
+run can skip the stages whose inputs have not changed.
+
+The fingerprint of a stage covers the shell code of the stage (read from
+standard input), the files and environment variables listed for it in
+`STAGE_INPUTS`, the set-up versions of all EUPS products, the identity of
+the repository and the fingerprints recorded for the stages it depends on.
+A stage that is re-run therefore invalidates every stage after it. Nothing
+here queries the repository.
+"""
+
+import hashlib
+import os
+import sys
+import time
+
+import click
+
+from demo_utils import STAGES, file_digest, locked_json
+
+# Files and directories, relative to the package root unless they start
+# with an environment variable, and environment variables that the result
+# of each stage depends on besides its shell code. Switches that only change
+# how fast a stage runs are left out.
+STAGE_INPUTS = {
+    "seed": {
+        "paths": ("input_data", "${PIPELINES_CHECK_DIR}/configs", "bin.src/calib_compression.py",
+                  "bin.src/fast_import.py", "bin.src/ingest_raws.py"),
+        "env": ("PIPELINES_CHECK_UNCOMPRESSED_CALIBS", "PIPELINES_CHECK_TMPFS"),
+    },
+    "input_chain": {"paths": (), "env": ()},
+    "main_run": {"paths": ("${DRP_PIPE_DIR}/pipelines",), "env": ()},
+    "empty_query": {"paths": ("${DRP_PIPE_DIR}/pipelines",), "env": ()},
+    "replace_run": {"paths": ("${DRP_PIPE_DIR}/pipelines",), "env": ()},
+    # A resumed bring_home stage executes the graph again, so a change to
+    # it changes the qbb stage as well.
+    "qbb": {
+        "paths": ("${DRP_PIPE_DIR}/pipelines", "bin.src/run_qbb_graph.py", "bin.src/transfer_throughput.py",
+                  "bin.src/verify_run.py", "bin.src/demo_utils.py", "tests"),
+        "env": ("PIPELINES_CHECK_QBB_DRIVER", "PIPELINES_CHECK_TRANSFER_THROUGHPUT",
+                "PIPELINES_CHECK_SEPARATE_TESTS"),
+    },
+    "bring_home": {
+        "paths": ("bin.src/verify_run.py", "bin.src/demo_utils.py", "tests"),
+        "env": ("PIPELINES_CHECK_SEPARATE_TESTS",),
+    },
+    "tests": {"paths": ("tests",), "env": ()},
+    "compare_runs": {
+        "paths": ("bin.src/compare_runs.py",),
+        "env": ("PIPELINES_CHECK_COMPARE_RUNS", "PIPELINES_CHECK_COMPARE_RTOL",
+                "PIPELINES_CHECK_COMPARE_ATOL"),
+    },
+    "benchmark": {
+        "paths": ("bin.src/quantum_benchmark.py",),
+        "env": ("PIPELINES_CHECK_BENCHMARK", "PIPELINES_CHECK_BENCHMARK_BASELINE"),
+    },
+}
+
+# Every run creates a new butler.yaml, so its inode and modification time
+# tell one repository from another at the same path.
+REPO_CONFIG = os.path.join("DATA_REPO", "butler.yaml")
+
+
+def _open_manifest(path):
+    """Open the manifest for update, holding a lock so that stages running
+    in parallel do not lose each other's records.
+    """
+    return locked_json(path, {"stages": {}, "digests": {}})
+
+
+def _iter_files(path):
+    """Yield the files below a path in a stable order, skipping caches."""
+    if not os.path.isdir(path):
+        yield path
+        return
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d != "__pycache__" and not d.startswith("."))
+        for filename in sorted(filenames):
+            if not filename.endswith(".pyc"):
+                yield os.path.join(dirpath, filename)
+
+
+def fingerprint(name, definition, manifest):
+    """Compute the fingerprint of a stage.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the stage.
+    definition : `str`
+        Shell code of the stage.
+    manifest : `dict`
+        The manifest, holding the fingerprints of earlier stages and the
+        cached file digests, which are updated.
+
+    Returns
+    -------
+    fingerprint : `str`
+        Hex digest of everything the stage depends on.
+    """
+    inputs = STAGE_INPUTS[name]
+    key = hashlib.sha256()
+    key.update(definition.encode())
+    for path in inputs["paths"]:
+        path = os.path.expandvars(path)
+        key.update(path.encode())
+        if not os.path.exists(path):
+            continue
+        for filename in _iter_files(path):
+            key.update(os.path.relpath(filename, path).encode())
+            key.update(file_digest(filename, manifest["digests"]).encode())
+    for variable in inputs["env"]:
+        key.update(f"{variable}={os.environ.get(variable, '')}".encode())
+    for variable in sorted(os.environ):
+        if variable.startswith("SETUP_"):
+            key.update(f"{variable}={os.environ[variable]}".encode())
+    try:
+        stat = os.stat(REPO_CONFIG)
+        key.update(f"{stat.st_ino}:{stat.st_mtime_ns}".encode())
+    except FileNotFoundError:
+        pass
+    for need in STAGES[name]:
+        key.update(f"{need}={manifest['stages'].get(need, {}).get('fingerprint')}".encode())
+    return key.hexdigest()
+
+
+def stage_status(name, definition, manifest):
+    """Return whether a stage needs to run.
+
+    Returns
+    -------
+    status : `str`
+        ``current`` if the stage finished with the same fingerprint,
+        ``resume`` if it started with the same fingerprint but did not
+        finish (its checkpoints tell how far it got), ``changed`` if it ran
+        with a different fingerprint and ``new`` if it has never run.
+    """
+    entry = manifest["stages"].get(name)
+    if entry is None:
+        return "new"
+    if entry["fingerprint"] != fingerprint(name, definition, manifest):
+        return "changed"
+    return "current" if entry["state"] == "done" else "resume"
+
+
+@click.group()
+@click.option("--manifest", "manifest_file", default="stage_manifest.json", show_default=True,
+              help="Manifest file.")
+@click.argument("name", type=click.Choice(list(STAGES)))
+@click.pass_context
+def cli(ctx, manifest_file, name):
+    """Record and check the runs of stage NAME, whose shell code is read
+    from standard input.
+    """
+    ctx.obj = {"manifest": manifest_file, "name": name, "definition": sys.stdin.read()}
+
+
+@cli.command()
+@click.pass_obj
+def status(obj):
+    """Print whether the stage is current, should be resumed, has changed
+    or is new.
+    """
+    with _open_manifest(obj["manifest"]) as manifest:
+        print(stage_status(obj["name"], obj["definition"], manifest))
+
+
+def _record(obj, state):
+    with _open_manifest(obj["manifest"]) as manifest:
+        entry = {
+            "fingerprint": fingerprint(obj["name"], obj["definition"], manifest),
+            "state": state,
+            "time": time.time(),
+            "checkpoints": [],
+        }
+        # An attempt that resumes an interrupted one keeps what it reached.
+        previous = manifest["stages"].get(obj["name"])
+        if state == "started" and previous is not None and previous["state"] == "started" \
+                and previous["fingerprint"] == entry["fingerprint"]:
+            entry["checkpoints"] = previous.get("checkpoints", [])
+        manifest["stages"][obj["name"]] = entry
+
+
+@cli.command()
+@click.pass_obj
+def start(obj):
+    """Record that the stage has started."""
+    _record(obj, "started")
+
+
+@cli.command()
+@click.argument("label")
+@click.pass_obj
+def checkpoint(obj, label):
+    """Record that the running stage has reached LABEL."""
+    with _open_manifest(obj["manifest"]) as manifest:
+        entry = manifest["stages"].get(obj["name"])
+        if entry is None or entry["state"] != "started":
+            raise click.ClickException(f"Stage {obj['name']} has not been started.")
+        if label not in entry["checkpoints"]:
+            entry["checkpoints"].append(label)
+
+
+@cli.command()
+@click.argument("label")
+@click.pass_obj
+def reached(obj, label):
+    """Exit with status 0 if an earlier attempt at the stage reached LABEL
+    and 1 otherwise.
+    """
+    with _open_manifest(obj["manifest"]) as manifest:
+        entry = manifest["stages"].get(obj["name"], {})
+    sys.exit(0 if label in entry.get("checkpoints", []) else 1)
+
+
+@cli.command()
+@click.pass_obj
+def done(obj):
+    """Record that the stage has finished."""
+    _record(obj, "done")
+
+
+if __name__ == "__main__":
+    cli()
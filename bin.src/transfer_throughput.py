@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Throughput of the ways of bringing home the outputs of a quantum graph.
+
+``graph`` times ``butler zip-from-graph`` followed by ``butler ingest-zip``,
+``butler transfer-from-graph`` and ``butler aggregate-graph`` on separate
+clones of a repository in which the graph has been executed with a
+quantum-backed butler but whose outputs have not yet been brought home. The
+verbose log of each command is parsed as it arrives.
+
+``synthetic`` puts a chosen number of datasets of a chosen size into a
+scratch repository and times the transfer and zip APIs underlying those
+commands, to help choose between them for large workflows.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+from demo_utils import LOG_OPTIONS, stream_command
+from seed_repo_cache import clone_tree
+
+
+def run_datasets(repo, run):
+    """Return the number and total file size of the datasets of a run."""
+    from lsst.daf.butler import Butler, MissingCollectionError
+
+    butler = Butler(repo, writeable=False)
+    try:
+        refs = list(butler.registry.queryDatasets(..., collections=run))
+    except MissingCollectionError:
+        return 0, 0
+    size = 0
+    for uris in butler.get_many_uris(refs).values():
+        for uri in (uris.primaryURI, *uris.componentURIs.values()):
+            if uri is not None:
+                size += uri.size()
+    return len(refs), size
+
+
+def graph_paths(graph, repo, zip_dir):
+    """Return the commands of each way of bringing home the outputs."""
+    return {
+        "zip": [["butler", *LOG_OPTIONS, "zip-from-graph", graph, repo, zip_dir],
+                ["butler", *LOG_OPTIONS, "ingest-zip", repo, None]],
+        "transfer": [["butler", *LOG_OPTIONS, "transfer-from-graph", graph, repo]],
+        "aggregate": [["butler", *LOG_OPTIONS, "aggregate-graph", graph, repo]],
+    }
+
+
+def _rate(count, seconds):
+    return count / seconds if seconds else float("nan")
+
+
+def _print_results(results):
+    print(f"{'path':12s} {'datasets':>8s} {'MiB':>9s} {'wall':>8s} {'datasets/s':>11s} {'MiB/s':>9s}")
+    for name, result in results.items():
+        print(f"{name:12s} {result['datasets']:8d} {result['bytes'] / 2**20:9.1f} {result['wall']:7.2f}s "
+              f"{result['datasets_per_s']:11.1f} {result['bytes_per_s'] / 2**20:9.1f}")
+
+
+@click.group()
+@click.option("--json", "json_file", help="Write the results to this file.")
+def cli(json_file):
+    """Measure dataset transfer throughput."""
+
+
+@cli.result_callback()
+def _write_json(results, json_file):
+    if json_file:
+        with open(json_file, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+@cli.command()
+@click.argument("repo")
+@click.argument("graph")
+@click.option("--output-run", required=True, help="Run collection the graph writes to.")
+@click.option("--paths", default="zip,transfer,aggregate", show_default=True,
+              help="Comma-separated paths to time.")
+@click.option("--workdir", default=None, help="Directory for the repository clones; temporary by default.")
+@click.option("--clone-method", type=click.Choice(["hardlink", "reflink", "copy"]), default="reflink",
+              show_default=True,
+              help="How to clone REPO. Ingesting a zip may write to files that a hardlink would share.")
+@click.option("--echo", is_flag=True, help="Echo the output of the commands.")
+def graph(repo, graph, output_run, paths, workdir, clone_method, echo):
+    """Time each way of bringing the outputs of GRAPH home to REPO.
+
+    REPO itself is not modified.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(dir=workdir) as scratch:
+        for name in paths.split(","):
+            clone = os.path.join(scratch, name)
+            zip_dir = os.path.join(scratch, f"{name}_zip")
+            os.makedirs(zip_dir)
+            clone_tree(repo, clone, method=clone_method)
+            steps = []
+            for command in graph_paths(graph, clone, zip_dir)[name]:
+                if None in command:
+                    # The zip file written by the previous command.
+                    if steps[-1]["zip"] is None:
+                        raise RuntimeError(f"No zip file found in the output of {steps[-1]['command']}.")
+                    command[command.index(None)] = os.path.join(zip_dir, os.path.basename(steps[-1]["zip"]))
+                steps.append(stream_command(command, echo=echo))
+            n_datasets, n_bytes = run_datasets(clone, output_run)
+            wall = sum(step["wall"] for step in steps)
+            results[name] = {
+                "datasets": n_datasets,
+                "bytes": n_bytes,
+                "wall": wall,
+                "datasets_per_s": _rate(n_datasets, wall),
+                "bytes_per_s": _rate(n_bytes, wall),
+                "steps": steps,
+            }
+            reported = [step["reported"] for step in steps if step["reported"] is not None]
+            if reported and reported[-1] != n_datasets:
+                print(f"WARNING: {name} reported {reported[-1]} datasets but {n_datasets} are in "
+                      f"{output_run}.", file=sys.stderr)
+            shutil.rmtree(clone)
+    _print_results(results)
+    return results
+
+
+def make_synthetic_repo(root, count, size):
+    """Create a repository holding synthetic datasets.
+
+    Each dataset is a byte array of ``size`` bytes for one detector of a
+    synthetic instrument.
+
+    Returns
+    -------
+    butler : `lsst.daf.butler.Butler`
+        Butler for the new repository.
+    refs : `list` [`lsst.daf.butler.DatasetRef`]
+        The datasets.
+    """
+    import numpy as np
+    from lsst.daf.butler import Butler, DatasetType
+
+    Butler.makeRepo(root)
+    butler = Butler(root, writeable=True, run="synthetic")
+    butler.registry.insertDimensionData(
+        "instrument", {"name": "Synthetic", "detector_max": count, "visit_max": 1, "exposure_max": 1}
+    )
+    butler.registry.insertDimensionData(
+        "detector", *[{"instrument": "Synthetic", "id": i, "full_name": f"S{i}"} for i in range(count)]
+    )
+    dataset_type = DatasetType("synthetic", ["instrument", "detector"], "NumpyArray",
+                               universe=butler.dimensions)
+    butler.registry.registerDatasetType(dataset_type)
+    rng = np.random.default_rng(0)
+    refs = []
+    with butler.transaction():
+        for i in range(count):
+            # Random bytes so that the zip path does not gain from compression.
+            payload = rng.integers(0, 256, size=size, dtype=np.uint8)
+            refs.append(butler.put(payload, dataset_type, instrument="Synthetic", detector=i))
+    return butler, refs
+
+
+def _make_target(root, source, refs):
+    """Create an empty repository with the dimension records and dataset
+    types needed to receive ``refs``.
+    """
+    from lsst.daf.butler import Butler
+
+    Butler.makeRepo(root)
+    target = Butler(root, writeable=True)
+    target.registry.insertDimensionData("instrument", *source.registry.queryDimensionRecords("instrument"))
+    target.registry.insertDimensionData("detector", *source.registry.queryDimensionRecords("detector"))
+    target.registry.registerDatasetType(refs[0].datasetType)
+    return target
+
+
+@cli.command()
+@click.option("--count", default=1000, show_default=True, help="Number of datasets.")
+@click.option("--size", default=100_000, show_default=True, help="Size of each dataset in bytes.")
+@click.option("--workdir", default=None, help="Directory for the scratch repositories.")
+def synthetic(count, size, workdir):
+    """Time direct and zip transfers of synthetic datasets."""
+    with tempfile.TemporaryDirectory(dir=workdir) as scratch:
+        t0 = time.perf_counter()
+        source, refs = make_synthetic_repo(os.path.join(scratch, "source"), count, size)
+        print(f"Created {count} datasets of {size} bytes in {time.perf_counter() - t0:.2f}s")
+        n_bytes = sum(uris.primaryURI.size() for uris in source.get_many_uris(refs).values())
+
+        results = {}
+        target = _make_target(os.path.join(scratch, "transfer"), source, refs)
+        t0 = time.perf_counter()
+        transferred = target.transfer_from(source, refs, transfer="copy")
+        wall = time.perf_counter() - t0
+        results["transfer"] = {"datasets": len(transferred), "bytes": n_bytes, "wall": wall}
+
+        target = _make_target(os.path.join(scratch, "zip"), source, refs)
+        t0 = time.perf_counter()
+        zip_uri = source.retrieve_artifacts_zip(refs, os.path.join(scratch, "zip_dir"))
+        zip_wall = time.perf_counter() - t0
+        target.ingest_zip(zip_uri, transfer="copy")
+        wall = time.perf_counter() - t0
+        n_ingested = len(set(target.registry.queryDatasets(refs[0].datasetType, collections="synthetic")))
+        results["zip"] = {"datasets": n_ingested, "bytes": n_bytes, "wall": wall, "zip_wall": zip_wall,
+                          "zip_bytes": zip_uri.size()}
+
+    for result in results.values():
+        result["datasets_per_s"] = _rate(result["datasets"], result["wall"])
+        result["bytes_per_s"] = _rate(result["bytes"], result["wall"])
+    _print_results(results)
+    print(f"Zip file written in {results['zip']['zip_wall']:.2f}s, "
+          f"{results['zip']['zip_bytes'] / 2**20:.1f} MiB.")
+    return {"count": count, "size": size, "results": results}
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bring home the outputs of the quantum-backed butler run and verify the
+repository from a single process.
+
+The ``butler`` commands that bring the datasets home still run one at a
+time as separate processes, since they are what is being checked. The
+dataset counts they report, the output chain after each of them and
+finally the tests in ``tests/`` are all checked from this process, with one
+butler shared by all the checks. Heavy imports are made only when first
+needed and timed separately from the checks.
+"""
+
+import os
+import sys
+
+import click
+
+from demo_utils import (
+    AGGREGATE_COUNT_PATTERN,
+    LOG_OPTIONS,
+    TRANSFER_COUNT_PATTERN,
+    PhaseTimer,
+    stream_command,
+)
+
+TESTDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests")
+
+
+def bring_home_steps(graph_file, repo, zip_dir):
+    """Return the bring-home commands and what to check after each.
+
+    Each step is a `dict` with a ``name``, the ``command``, the
+    ``expected`` number of datasets it reports on every line matching
+    ``pattern`` and whether the output run should be in the output chain
+    afterwards (``in_chain``). Neither is checked if `None`.
+    """
+    butler = ["butler", *LOG_OPTIONS]
+    return [
+        # Ingest some datasets via a zip file; the zip file name is only
+        # known once it has been written.
+        {"name": "zip-from-graph",
+         "command": [*butler, "zip-from-graph", graph_file, repo, zip_dir, "-d", "cal*"],
+         "expected": None, "pattern": None, "in_chain": None},
+        {"name": "ingest-zip",
+         "command": ["butler", "ingest-zip", repo, None],
+         "expected": None, "pattern": None, "in_chain": None},
+        # Transfer nothing (because calexp already ingested via zip), don't
+        # ask to update chain.
+        {"name": "transfer calexp",
+         "command": [*butler, "transfer-from-graph", "-d", "calexp", graph_file, repo],
+         "expected": 0, "pattern": TRANSFER_COUNT_PATTERN, "in_chain": False},
+        # Transfer one, don't ask to update chain.
+        {"name": "transfer postISRCCD",
+         "command": [*butler, "transfer-from-graph", "-d", "postISRCCD", graph_file, repo],
+         "expected": 1, "pattern": TRANSFER_COUNT_PATTERN, "in_chain": False},
+        # Transfer nothing, ask to update chain.
+        {"name": "transfer chain",
+         "command": [*butler, "transfer-from-graph", "-d", "calexp", "--update-output-chain",
+                     graph_file, repo],
+         "expected": 0, "pattern": TRANSFER_COUNT_PATTERN, "in_chain": True},
+        # Transfer the rest and make sure the run is still in the chain.
+        # aggregate-graph is only used for this step since it does not
+        # support ingesting only certain dataset types.
+        {"name": "aggregate-graph",
+         "command": [*butler, "aggregate-graph", "--update-output-chain", graph_file, repo],
+         "expected": 12, "pattern": AGGREGATE_COUNT_PATTERN, "in_chain": True},
+    ]
+
+
+@click.command()
+@click.argument("repo")
+@click.argument("graph_file")
+@click.option("--output-run", required=True, help="Run collection the graph writes to.")
+@click.option("--output-chain", required=True, help="Chained collection the graph writes to.")
+@click.option("--zip-dir", default=".", show_default=True, help="Directory to write the zip file to.")
+@click.option("--tests/--no-tests", "run_tests", default=True, show_default=True,
+              help="Run the tests in tests/ once the datasets are home.")
+def main(repo, graph_file, output_run, output_chain, zip_dir, run_tests):
+    """Bring the outputs of GRAPH_FILE home to REPO, checking the reported
+    counts and the output chain after each step, then run the tests.
+    """
+    timer = PhaseTimer()
+    failures = []
+
+    # The tests import their helpers by bare name; sharing the modules
+    # shares the cached butler with them.
+    sys.path.insert(0, TESTDIR)
+    with timer("import butler"):
+        from butler_snapshot import DEFAULT_ROOT, get_butler
+        from check_update_chain import check_chain
+    with timer("create butler"):
+        if os.path.realpath(repo) == os.path.realpath(DEFAULT_ROOT):
+            butler = get_butler()
+        else:
+            butler = get_butler(repo)
+
+    last_output = None
+    for step in bring_home_steps(graph_file, repo, zip_dir):
+        command = step["command"]
+        if None in command:
+            if last_output is None or last_output["zip"] is None:
+                # The remaining steps expect the zip file to be ingested.
+                failures.append(f"{step['name']}: no zip file found in the output of the previous step.")
+                break
+            command[command.index(None)] = os.path.join(zip_dir, os.path.basename(last_output["zip"]))
+        with timer(step["name"]):
+            patterns = (step["pattern"],) if step["pattern"] else ()
+            last_output = stream_command(command, echo=True, count_patterns=patterns)
+        with timer("checks"):
+            if step["expected"] is not None:
+                if not last_output["counts"]:
+                    failures.append(f"{step['name']}: transferred dataset count not found in output.")
+                for count in last_output["counts"]:
+                    if count != step["expected"]:
+                        failures.append(f"{step['name']}: {count} datasets transferred; "
+                                        f"expected {step['expected']}.")
+            if step["in_chain"] is not None:
+                # The command has changed the repository behind the back of
+                # this butler.
+                butler.registry.refresh()
+                if check_chain(butler, output_run, output_chain, step["in_chain"]):
+                    failures.append(f"{step['name']}: output chain check failed.")
+
+    if run_tests and not failures:
+        with timer("import pytest"):
+            import pytest
+        with timer("tests"):
+            butler.registry.refresh()
+            if pytest.main([TESTDIR]) != 0:
+                failures.append("tests failed.")
+
+    timer.report()
+    for failure in failures:
+        print(f"ERROR: {failure}", file=sys.stderr)
+    sys.exit(int(bool(failures)))
+
+
+if __name__ == "__main__":
+    main()
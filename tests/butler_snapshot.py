@@ -0,0 +1,100 @@
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Shared read-only access to the output repository of the test run."""
+
+from __future__ import annotations
+
+import functools
+import os
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+
+from lsst.daf.butler import Butler, DatasetRef
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+
+DEFAULT_ROOT = os.path.join(TESTDIR, os.path.pardir, "DATA_REPO")
+
+
+@functools.cache
+def get_butler(root: str = DEFAULT_ROOT) -> Butler:
+    """Return a read-only butler for the repository, created once per
+    process.
+    """
+    return Butler(root, writeable=False)
+
+
+@functools.cache
+def get_chain_collections(chain: str, root: str = DEFAULT_ROOT) -> tuple[str, ...]:
+    """Return the flattened collections of a chain.
+
+    The output repository does not change while the tests run, so the
+    registry is only asked once per chain.
+    """
+    butler = get_butler(root)
+    return tuple(butler.registry.queryCollections(chain, flattenChains=True))
+
+
+@functools.cache
+def get_run_datasets(run: str, datasetType=..., root: str = DEFAULT_ROOT) -> frozenset[DatasetRef]:
+    """Return all the datasets of a type in a run collection, querying the
+    registry only once per run and dataset type.
+    """
+    butler = get_butler(root)
+    return frozenset(butler.registry.queryDatasets(datasetType=datasetType, collections=run))
+
+
+def check_stored(
+    butler: Butler, refs: Iterable[DatasetRef], n_threads: int = 8
+) -> dict[DatasetRef, bool]:
+    """Check that the datastore artifacts of many datasets exist.
+
+    The artifact locations of all the datasets are looked up with a single
+    datastore query, and only the file checks themselves are spread over a
+    thread pool.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler holding the datasets.
+    refs : `~collections.abc.Iterable` [`lsst.daf.butler.DatasetRef`]
+        Resolved dataset references.
+    n_threads : `int`, optional
+        Number of threads checking artifacts.
+
+    Returns
+    -------
+    stored : `dict` [`lsst.daf.butler.DatasetRef`, `bool`]
+        Whether all the artifacts of each dataset exist. Datasets without
+        any datastore record are reported as missing.
+    """
+    refs = list(refs)
+    stored = dict.fromkeys(refs, False)
+    uris_by_ref = {}
+    for ref, uris in butler.get_many_uris(refs).items():
+        uris_by_ref[ref] = [uri for uri in (uris.primaryURI, *uris.componentURIs.values()) if uri is not None]
+    all_uris = {uri for uris in uris_by_ref.values() for uri in uris}
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        exists = dict(zip(all_uris, pool.map(lambda uri: uri.exists(), all_uris)))
+    for ref, uris in uris_by_ref.items():
+        stored[ref] = bool(uris) and all(exists[uri] for uri in uris)
+    return stored
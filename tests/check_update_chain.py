@@ -27,15 +27,15 @@ from lsst.daf.butler import Butler, MissingCollectionError
 
 
 def check_chain(
-    butler_uri: str, output_run: str, output_chain: str, run_should_exist: bool
+    butler_uri: str | Butler, output_run: str, output_chain: str, run_should_exist: bool
 ) -> bool:
     """Check whether output run collection is in the output chain collection
     and that chain is flattened.
 
     Parameters
     ----------
-    butler_uri : `str`
-        Butler connection string.
+    butler_uri : `str` or `lsst.daf.butler.Butler`
+        Butler connection string, or an existing butler to reuse.
     output_run : `str`
         Output run collection.
     output_chain : `str`
@@ -43,7 +43,7 @@ def check_chain(
     run_should_exist : `bool`
         Whether the output run should exist in the output chain.
     """
-    butler = Butler(butler_uri)
+    butler = Butler(butler_uri) if isinstance(butler_uri, str) else butler_uri
     error = False
 
     try:
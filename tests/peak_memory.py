@@ -0,0 +1,96 @@
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Peak resident memory of blocks of code within one process."""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import resource
+import sys
+from collections.abc import Iterator, MutableMapping
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident set size of this process to its current
+    size.
+
+    Returns
+    -------
+    reset : `bool`
+        Whether the peak could be reset. Only Linux supports this; elsewhere
+        the peak stays the largest size since the process started.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def get_peak_rss() -> int:
+    """Return the peak resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+
+@contextlib.contextmanager
+def track_peak_rss(results: MutableMapping[str, dict], name: str) -> Iterator[None]:
+    """Record the peak resident set size reached within a block.
+
+    Parameters
+    ----------
+    results : `~collections.abc.MutableMapping` [`str`, `dict`]
+        Where to store the ``peak_rss`` in bytes under ``name``, together
+        with whether the peak could be ``reset`` before the block.
+    name : `str`
+        Name of the block.
+    """
+    reset = reset_peak_rss()
+    try:
+        yield
+    finally:
+        results[name] = {"peak_rss": get_peak_rss(), "reset": reset}
+
+
+def report_peak_rss(results: MutableMapping[str, dict], path: str | None = None) -> str:
+    """Format peak memory results as a table, optionally writing them to a
+    JSON file as well.
+    """
+    if path:
+        with open(path, "w") as fh:
+            json.dump(results, fh, indent=2)
+    lines = [f"{'check':40s} {'peak RSS':>10s}"]
+    for name, result in results.items():
+        note = "" if result["reset"] else " (process peak)"
+        lines.append(f"{name:40s} {result['peak_rss'] / 2**20:6.0f} MiB{note}")
+    return "\n".join(lines)
@@ -0,0 +1,212 @@
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Single-pass, block-wise statistics of image planes and the expected
+values they are validated against.
+"""
+
+from __future__ import annotations
+
+import os
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import yaml
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+
+# File holding the expected output values for each validated detector.
+EXPECTED_VALUES_FILE = os.path.join(TESTDIR, "data", "validate_outputs.yaml")
+
+# Number of rows of a plane summarized at once. Bounds the float64
+# temporaries to a few MB for an HSC CCD.
+DEFAULT_BLOCK_ROWS = 256
+
+DEFAULT_THREADS = min(4, os.cpu_count() or 1)
+
+
+@dataclass
+class PlaneStatistics:
+    """Summary statistics of a set of pixel values that can be updated one
+    block at a time.
+
+    Blocks are combined with the pairwise update of Chan et al., the
+    parallel form of Welford's algorithm, so the result does not depend on
+    keeping all the pixels in memory.
+    """
+
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    min: float = np.inf
+    max: float = -np.inf
+    n_zero: int = 0
+    """Number of pixels that are exactly zero; for a mask plane this is the
+    number of unflagged pixels."""
+
+    @classmethod
+    def from_block(cls, block: np.ndarray) -> PlaneStatistics:
+        """Summarize a single block of pixels."""
+        if block.size == 0:
+            return cls()
+        values = block.astype(np.float64, copy=False).ravel()
+        mean = values.mean()
+        residuals = values - mean
+        return cls(
+            count=values.size,
+            mean=float(mean),
+            m2=float(np.dot(residuals, residuals)),
+            min=float(values.min()),
+            max=float(values.max()),
+            n_zero=int(values.size - np.count_nonzero(block)),
+        )
+
+    def merge(self, other: PlaneStatistics) -> None:
+        """Fold the statistics of another block into these."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max, self.n_zero = other.min, other.max, other.n_zero
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.n_zero += other.n_zero
+
+    @property
+    def variance(self) -> float:
+        """Population variance, as returned by `numpy.var`."""
+        return self.m2 / self.count if self.count else np.nan
+
+    @property
+    def std(self) -> float:
+        """Population standard deviation, as returned by `numpy.std`."""
+        return float(np.sqrt(self.variance))
+
+
+def iter_row_blocks(array: np.ndarray, block_rows: int = DEFAULT_BLOCK_ROWS) -> Iterator[np.ndarray]:
+    """Yield views of consecutive strips of rows of a 2-d array."""
+    for start in range(0, array.shape[0], block_rows):
+        yield array[start:start + block_rows]
+
+
+def iter_bbox_strips(
+    x0: int, y0: int, width: int, height: int, block_rows: int = DEFAULT_BLOCK_ROWS
+) -> Iterator[tuple[int, int, int, int]]:
+    """Divide a bounding box into strips of rows.
+
+    Yields
+    ------
+    strip : `tuple` [`int`, `int`, `int`, `int`]
+        Minimum x and y, width and height of each strip, suitable for a
+        bounding box ``parameters`` entry of a butler read.
+    """
+    for y in range(y0, y0 + height, block_rows):
+        yield x0, y, width, min(block_rows, y0 + height - y)
+
+
+def _bounded_map(func: Callable, items: Iterable, n_threads: int) -> Iterator:
+    """Like `ThreadPoolExecutor.map` but with at most ``2 * n_threads``
+    items in flight, so that lazily produced blocks are not all read before
+    the first is summarized.
+    """
+    if n_threads <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * n_threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def reduce_blocks(blocks: Iterable[np.ndarray], n_threads: int = DEFAULT_THREADS) -> PlaneStatistics:
+    """Compute statistics of all pixels in a stream of blocks.
+
+    Parameters
+    ----------
+    blocks : `~collections.abc.Iterable` [`numpy.ndarray`]
+        Blocks of pixels, e.g. from `iter_row_blocks` or from reading an
+        image one strip at a time.
+    n_threads : `int`, optional
+        Number of threads summarizing blocks. NumPy releases the GIL in the
+        reductions, so blocks are processed concurrently.
+
+    Returns
+    -------
+    stats : `PlaneStatistics`
+        Statistics of all the pixels.
+    """
+    stats = PlaneStatistics()
+    for block_stats in _bounded_map(PlaneStatistics.from_block, blocks, n_threads):
+        stats.merge(block_stats)
+    return stats
+
+
+def load_expected_values(path: str = EXPECTED_VALUES_FILE) -> list[dict]:
+    """Read the expected output values of every validated detector.
+
+    Returns
+    -------
+    detectors : `list` [`dict`]
+        One entry per detector, with ``instrument``, ``visit`` and
+        ``detector`` keys and a mapping of expected values for each checked
+        dataset type.
+    """
+    with open(path) as fh:
+        return yaml.safe_load(fh)["detectors"]
+
+
+def iter_checks(measured: Mapping[str, float], expected: Mapping[str, Mapping]) -> Iterator[tuple]:
+    """Pair measured quantities with their expected values.
+
+    Parameters
+    ----------
+    measured : `~collections.abc.Mapping` [`str`, `float`]
+        Measured values keyed by quantity name.
+    expected : `~collections.abc.Mapping` [`str`, `~collections.abc.Mapping`]
+        Expected ``value`` and absolute tolerance ``atol`` keyed by quantity
+        name.
+
+    Yields
+    ------
+    name : `str`
+        Quantity name.
+    value : `float`
+        Measured value, `None` if the quantity was not measured.
+    expected : `float`
+        Expected value.
+    atol : `float`
+        Absolute tolerance.
+    """
+    for name, spec in expected.items():
+        yield name, measured.get(name), spec["value"], spec.get("atol", 0)
@@ -21,14 +21,12 @@
 
 """Output butler from pipelines_check test run."""
 
-import os
 import unittest
 
-from lsst.daf.butler import Butler
 from lsst.daf.base import PropertySet
 from lsst.pipe.base import TaskMetadata
 
-TESTDIR = os.path.abspath(os.path.dirname(__file__))
+from butler_snapshot import check_stored, get_butler, get_chain_collections, get_run_datasets
 
 # These collection names must match those used in the run_demo.sh
 # script.
@@ -39,15 +37,15 @@ QBB_CHAIN = "demo_collection_qbb"
 class PiplinesCheckTestCase(unittest.TestCase):
     """Check outputs from test run."""
 
-    def setUp(self):
-        """Create a new butler root for each test."""
-        root = os.path.join(TESTDIR, os.path.pardir, "DATA_REPO")
-        self.butler = Butler(root, writeable=False)
+    @classmethod
+    def setUpClass(cls):
+        """Share one read-only butler between all the tests."""
+        cls.butler = get_butler()
 
     def _get_datasets_from_chain(self, chain, datasetType=...):
         """Return all the datasets from the first run in chain.
         """
-        collections = list(self.butler.registry.queryCollections(chain, flattenChains=True))
+        collections = list(get_chain_collections(chain))
         # Choose the collection to query, and query datasets in that
         # collection.
         # The collection to query datasets from will be named "demo_collection"
@@ -60,7 +58,7 @@ class PiplinesCheckTestCase(unittest.TestCase):
         collections.remove(run)
         print(f"Retrieving datasets from run {run}")
 
-        refs = set(self.butler.registry.queryDatasets(datasetType=datasetType, collections=run))
+        refs = set(get_run_datasets(run, datasetType))
         return refs
 
     def testMetadata(self):
@@ -103,8 +101,9 @@ class PiplinesCheckTestCase(unittest.TestCase):
         """Check that the execution butler files are really there."""
 
         datasets = self._get_datasets_from_chain(QBB_CHAIN)
-        for ref in datasets:
-            self.assertTrue(self.butler.exists(ref))
+        stored = check_stored(self.butler, datasets)
+        missing = sorted(str(ref) for ref, exists in stored.items() if not exists)
+        self.assertEqual(missing, [])
 
     def testLogDataset(self):
         """Ensure that the logs are captured in both modes."""
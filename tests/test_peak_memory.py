@@ -0,0 +1,51 @@
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the peak memory tracking used when validating outputs."""
+import unittest
+
+import numpy as np
+
+from peak_memory import get_peak_rss, report_peak_rss, track_peak_rss
+
+
+class PeakMemoryTestCase(unittest.TestCase):
+    """Check that peaks are recorded for each block."""
+
+    def test_track(self):
+        """A large allocation shows up in the peak of its block."""
+        results = {}
+        with track_peak_rss(results, "small"):
+            pass
+        with track_peak_rss(results, "large"):
+            array = np.ones(64 * 2**20, dtype=np.uint8)
+            del array
+        self.assertGreater(results["small"]["peak_rss"], 0)
+        self.assertGreaterEqual(get_peak_rss(), results["small"]["peak_rss"])
+        self.assertIn("large", report_peak_rss(results))
+        if not results["large"]["reset"]:
+            # The peaks are both that of the whole process so far.
+            self.skipTest("The peak resident set size cannot be reset on this platform.")
+        self.assertGreaterEqual(results["large"]["peak_rss"] - results["small"]["peak_rss"], 32 * 2**20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Test the block-wise plane statistics used to validate outputs."""
+import unittest
+
+import numpy as np
+
+from plane_statistics import (
+    PlaneStatistics,
+    iter_bbox_strips,
+    iter_checks,
+    iter_row_blocks,
+    load_expected_values,
+    reduce_blocks,
+)
+
+
+class PlaneStatisticsTestCase(unittest.TestCase):
+    """Compare streaming statistics with direct NumPy reductions."""
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.image = rng.normal(4.5, 160.0, size=(1000, 300)).astype(np.float32)
+        self.mask = rng.choice(np.array([0, 0, 0, 1, 32], dtype=np.int32), size=(1000, 300))
+
+    def test_matches_numpy(self):
+        """Block size and thread count must not change the result."""
+        for block_rows in (1, 7, 256, 5000):
+            for n_threads in (1, 3):
+                with self.subTest(block_rows=block_rows, n_threads=n_threads):
+                    image = reduce_blocks(iter_row_blocks(self.image, block_rows), n_threads=n_threads)
+                    mask = reduce_blocks(iter_row_blocks(self.mask, block_rows), n_threads=n_threads)
+                    self.assertEqual(image.count, self.image.size)
+                    self.assertAlmostEqual(image.mean, self.image.mean(dtype=np.float64), delta=1e-9)
+                    self.assertAlmostEqual(image.std, self.image.std(dtype=np.float64), delta=1e-9)
+                    self.assertEqual(image.min, self.image.min())
+                    self.assertEqual(image.max, self.image.max())
+                    self.assertEqual(mask.n_zero, np.sum(self.mask == 0))
+
+    def test_empty(self):
+        """Empty blocks are ignored when merging."""
+        stats = reduce_blocks([np.zeros((0, 3)), np.array([[1.0, 2.0, 3.0]]), np.zeros((0, 3))])
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.mean, 2.0)
+        self.assertAlmostEqual(stats.variance, 2.0 / 3.0)
+        self.assertEqual(PlaneStatistics().count, 0)
+        self.assertTrue(np.isnan(PlaneStatistics().std))
+
+    def test_lazy_blocks(self):
+        """Blocks may come from a generator, e.g. strips read from disk."""
+        stats = reduce_blocks((block.copy() for block in iter_row_blocks(self.image, 10)), n_threads=2)
+        self.assertAlmostEqual(stats.mean, self.image.mean(dtype=np.float64), delta=1e-9)
+
+    def test_bbox_strips(self):
+        """Strips cover a bounding box exactly, in order."""
+        strips = list(iter_bbox_strips(5, 10, 30, 1000, block_rows=256))
+        self.assertEqual([height for *_, height in strips], [256, 256, 256, 232])
+        self.assertEqual(strips[0], (5, 10, 30, 256))
+        self.assertEqual(strips[-1], (5, 778, 30, 232))
+        self.assertEqual(list(iter_bbox_strips(0, 0, 4, 0)), [])
+
+    def test_expected_values(self):
+        """The expected values file is readable and complete."""
+        detectors = load_expected_values()
+        self.assertGreater(len(detectors), 0)
+        for entry in detectors:
+            checks = list(iter_checks({}, entry["calexp"]["values"]))
+            self.assertIn("im_mean", [name for name, *_ in checks])
+            for name, value, expected, atol in checks:
+                self.assertIsNone(value)
+                self.assertGreaterEqual(atol, 0, msg=name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Test that profiled steps keep the exit status of the command."""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+PROFILE_STEP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin.src",
+                            "profile_step.py")
+
+
+class ProfileStepTestCase(unittest.TestCase):
+    """Run failing and succeeding scripts through profile_step.py."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.report = os.path.join(self.tmpdir.name, "report.json")
+
+    def _run(self, source, profiler):
+        script = os.path.join(self.tmpdir.name, "step.py")
+        with open(script, "w") as fh:
+            fh.write(source)
+        result = subprocess.run([sys.executable, PROFILE_STEP, "run", "--report", self.report,
+                                 "--profiler", profiler, "--profile-dir", self.tmpdir.name, "--",
+                                 sys.executable, script, "--flag", "value"])
+        with open(self.report) as fh:
+            step = json.load(fh)["steps"][-1]
+        self.assertEqual(step["exit_code"], result.returncode)
+        return result.returncode, step
+
+    def test_exit_code(self):
+        for profiler in ("none", "cprofile"):
+            with self.subTest(profiler=profiler):
+                returncode, step = self._run("import sys\nsys.exit(3)\n", profiler)
+                self.assertEqual(returncode, 3)
+                if profiler == "cprofile":
+                    self.assertTrue(os.path.exists(step["profile"]))
+
+    def test_exception(self):
+        returncode, step = self._run("raise RuntimeError('failed')\n", "cprofile")
+        self.assertEqual(returncode, 1)
+        self.assertTrue(os.path.exists(step["profile"]))
+
+    def test_success(self):
+        source = "import sys\nassert sys.argv[1:] == ['--flag', 'value']\nassert __name__ == '__main__'\n"
+        returncode, step = self._run(source, "cprofile")
+        self.assertEqual(returncode, 0)
+        self.assertTrue(os.path.exists(step["profile"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# This file is part of pipelines_check.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Test cloning of repository directories."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin.src"))
+
+from seed_repo_cache import clone_tree  # noqa: E402
+
+
+class CloneTreeTestCase(unittest.TestCase):
+    """Clone a repository reached through a symbolic link."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.repo = os.path.join(self.tmpdir, "tmpfs", "DATA_REPO")
+        os.makedirs(os.path.join(self.repo, "run"))
+        for name in ("gen3.sqlite3", os.path.join("run", "calexp.fits")):
+            with open(os.path.join(self.repo, name), "w") as fh:
+                fh.write(name)
+        self.link = os.path.join(self.tmpdir, "DATA_REPO")
+        os.symlink(self.repo, self.link)
+
+    def test_symlinked_source(self):
+        for method in ("hardlink", "reflink", "copy"):
+            with self.subTest(method=method):
+                clone = os.path.join(self.tmpdir, f"clone_{method}")
+                clone_tree(self.link, clone, method=method)
+                self.assertFalse(os.path.islink(clone))
+                # Writing to the clone must leave the repository alone.
+                with open(os.path.join(clone, "gen3.sqlite3"), "w") as fh:
+                    fh.write("changed")
+                with open(os.path.join(self.repo, "gen3.sqlite3")) as fh:
+                    self.assertEqual(fh.read(), "gen3.sqlite3")
+                with open(os.path.join(clone, "run", "calexp.fits")) as fh:
+                    self.assertEqual(fh.read(), os.path.join("run", "calexp.fits"))
+                shutil.rmtree(clone)
+
+
+if __name__ == "__main__":
+    unittest.main()
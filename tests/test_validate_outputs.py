@@ -20,118 +20,143 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """Test calexp quantities from pipelines_check test run."""
 import os
+import sys
 import unittest
-import numpy as np
 
-from lsst.daf.butler import Butler
 import lsst.geom as geom
 import lsst.utils.tests
 
-TESTDIR = os.path.abspath(os.path.dirname(__file__))
+from butler_snapshot import get_butler
+from peak_memory import report_peak_rss, track_peak_rss
+from plane_statistics import (
+    iter_bbox_strips,
+    iter_checks,
+    iter_row_blocks,
+    load_expected_values,
+    reduce_blocks,
+)
 
 # These collection names must match those used in the run_demo.sh
 # script.
 MAIN_CHAIN = "demo_collection"
 
+# If set, the peak memory of each check is also written to this JSON file.
+RSS_REPORT_ENV = "PIPELINES_CHECK_RSS_REPORT"
+
 
 class TestValidateOutputs(lsst.utils.tests.TestCase):
     """Check values from outputs from test run."""
-    def setUp(self):
-        """Create a new butler root for each test."""
-        root = os.path.join(TESTDIR, os.path.pardir, "DATA_REPO")
-        self.butler = Butler(root, writeable=False, collections=[MAIN_CHAIN])
-        self.detector = 10
-        self.visit = 903342
-
-    def test_calexp(self):
-        """Test quantities in the calexp."""
-        exposure = self.butler.get("calexp", detector=self.detector, visit=self.visit)
-
-        self.assertEqual(exposure.getBBox(),
-                         geom.Box2I(geom.Point2I(0, 0), geom.Extent2I(2048, 4176)))
-        masked_image = exposure.maskedImage
-        num_good_pix = np.sum(masked_image.mask.array == 0)
-
-        image_arr = masked_image.image.array
-        im_mean = image_arr.mean(dtype=np.float64)
-        im_std = image_arr.std(dtype=np.float64)
-        var_arr = masked_image.variance.array
-        var_mean = var_arr.mean(dtype=np.float64)
-        var_std = var_arr.std(dtype=np.float64)
-
-        summary = exposure.info.getSummaryStats()
-
-        psf = exposure.psf
-        psf_avg_pos = psf.getAveragePosition()
-        psf_shape = psf.computeShape(psf_avg_pos)
-        psf_ixx = psf_shape.getIxx()
-        psf_iyy = psf_shape.getIyy()
-        psf_ixy = psf_shape.getIxy()
-
-        # NOTE: These values are purely empirical, and need to be
-        # updated to reflect major algorithmic changes.
-        # If this test fails after an algorithmic change due to
-        # small numeric changes here, check on slack at
-        # #dm-science-pipelines as to whether the changes are
-        # reasonable, and then replace the failing values by
-        # running the test to determine the updated values.
-        standard_atol = 5e-7
-        # TODO: Find a way to tighten psf-related atol in DM-46415.
-        psf_atol = 3e-5
-        for name, var, val, atol in [
-            ("im_mean", im_mean, 4.458095748957226, standard_atol),
-            ("im_std", im_std, 163.4734054186484, standard_atol),
-            ("var_mean", var_mean, 51.76499345997559, standard_atol),
-            ("var_std", var_std, 48.195043744459134, standard_atol),
-            ("num_good_pix", num_good_pix, 7731454, 0),
-            ("psf_ixx", psf_ixx, 4.25089264118243, psf_atol),
-            ("psf_iyy", psf_iyy, 4.67312079513306, psf_atol),
-            ("psf_ixy", psf_ixy, -0.57333870401708, psf_atol),
-            ("summary.psfSigma", summary.psfSigma, 2.11017973069387, psf_atol),
-            ("summary.psfIxx", summary.psfIxx, 4.27161756630291, psf_atol),
-            ("summary.psfIyy", summary.psfIyy, 4.71870977724065, psf_atol),
-            ("summary.psfIxy", summary.psfIxy, -0.57321443705645, psf_atol),
-            ("summary.psfArea", summary.psfArea, 82.56064354917795, psf_atol),
-            ("summary.ra", summary.ra, 320.75893204843811, standard_atol),
-            ("summary.dec", summary.dec, -0.23497854714484, standard_atol),
-            ("summary.zenithDistance", summary.zenithDistance, 21.04574293565909, standard_atol),
-            ("summary.zeroPoint", summary.zeroPoint, 30.54791820137500, 2e-5),
-            ("summary.skyBg", summary.skyBg, 179.19015502929688, 7e-6),
-            ("summary.skyNoise", summary.skyNoise, 7.38146939102471, standard_atol),
-            ("summary.meanVar", summary.meanVar, 47.65954782565453, standard_atol),
-        ]:
-            # Uncomment following line to get replacement code when
-            # values need updating.  Note that this does not include atol
+    @classmethod
+    def setUpClass(cls):
+        """Share one read-only butler between all the tests."""
+        cls.butler = get_butler()
+        # Expected values for every validated detector; see
+        # data/validate_outputs.yaml for how to update them.
+        cls.detectors = load_expected_values()
+        cls.peak_rss = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        print(report_peak_rss(cls.peak_rss, os.environ.get(RSS_REPORT_ENV)), file=sys.stderr)
+
+    def _get_detectors(self, dataset_type):
+        """Return the data ID and expected values of each detector with
+        expected values for the given dataset type.
+        """
+        return [
+            ({"instrument": entry["instrument"], "visit": entry["visit"], "detector": entry["detector"]},
+             entry[dataset_type])
+            for entry in self.detectors if dataset_type in entry
+        ]
+
+    def _iter_strips(self, ref, bbox):
+        """Read a pixel plane one strip of rows at a time.
+
+        Only the strip is read, so memory use does not grow with the size
+        of the image. The resolved component ref is read directly, so no
+        strip repeats the registry lookup.
+        """
+        for x0, y0, width, height in iter_bbox_strips(*bbox):
+            strip = geom.Box2I(geom.Point2I(x0, y0), geom.Extent2I(width, height))
+            yield self.butler.get(ref, parameters={"bbox": strip}).array
+
+    def _check_values(self, measured, expected):
+        """Compare measured quantities with their expected values."""
+        for name, var, val, atol in iter_checks(measured, expected):
+            # Uncomment following line to get replacement values when
+            # they need updating.  Note that this does not include atol
             # values.
-            # print(f'("{name}", {name}, {var:.14f}),')
+            # print(f'{name}: {{value: {var:.14f}}}')
             with self.subTest(name):
+                self.assertIsNotNone(var, msg=f"{name} was not measured")
                 self.assertFloatsAlmostEqual(var, val, atol=atol, rtol=0, msg=name)
 
+    def test_calexp(self):
+        """Test quantities in the calexp."""
+        for data_id, expected in self._get_detectors("calexp"):
+            with self.subTest(**data_id), track_peak_rss(self.peak_rss, f"calexp {data_id['detector']}"):
+                # Read only the components that are checked, never the
+                # whole exposure, all from one registry lookup.
+                ref = self.butler.find_dataset("calexp", data_id, collections=MAIN_CHAIN)
+                self.assertIsNotNone(ref)
+                bbox = expected["bbox"]
+                x0, y0, width, height = bbox
+                self.assertEqual(self.butler.get(ref.makeComponentRef("bbox")),
+                                 geom.Box2I(geom.Point2I(x0, y0), geom.Extent2I(width, height)))
+
+                stats = {
+                    plane: reduce_blocks(self._iter_strips(ref.makeComponentRef(plane), bbox))
+                    for plane in ("image", "mask", "variance")
+                }
+
+                summary = self.butler.get(ref.makeComponentRef("summaryStats"))
+
+                psf = self.butler.get(ref.makeComponentRef("psf"))
+                psf_avg_pos = psf.getAveragePosition()
+                psf_shape = psf.computeShape(psf_avg_pos)
+
+                measured = {
+                    "im_mean": stats["image"].mean,
+                    "im_std": stats["image"].std,
+                    "var_mean": stats["variance"].mean,
+                    "var_std": stats["variance"].std,
+                    "num_good_pix": stats["mask"].n_zero,
+                    "psf_ixx": psf_shape.getIxx(),
+                    "psf_iyy": psf_shape.getIyy(),
+                    "psf_ixy": psf_shape.getIxy(),
+                }
+                for name in expected["values"]:
+                    if name.startswith("summary."):
+                        measured[name] = getattr(summary, name.removeprefix("summary."))
+                self._check_values(measured, expected["values"])
+
     def test_background(self):
         """Test background level."""
-        bkg = self.butler.get("calexpBackground", detector=self.detector, visit=self.visit)
-
-        bg0_arr = bkg.getImage().array
-        bg_mean = bg0_arr.mean(dtype=np.float64)
-        bg_std = bg0_arr.std(dtype=np.float64)
-
-        for name, var, val in (
-            ("calexpBackground mean", bg_mean, 179.214146898947),
-            ("calexpBackground stddev", bg_std, 0.7532147347608282),
-        ):
-            with self.subTest(name):
-                self.assertFloatsAlmostEqual(var, val, atol=5e-7, msg=name)
+        for data_id, expected in self._get_detectors("calexpBackground"):
+            with self.subTest(**data_id), track_peak_rss(self.peak_rss, f"background {data_id['detector']}"):
+                # The background model can only be evaluated for the whole
+                # image; it is summarized without further full-size copies.
+                bkg = self.butler.get("calexpBackground", data_id, collections=MAIN_CHAIN)
+                stats = reduce_blocks(iter_row_blocks(bkg.getImage().array))
+                self._check_values(
+                    {"calexpBackground mean": stats.mean, "calexpBackground stddev": stats.std},
+                    expected["values"],
+                )
 
     def test_initial_psf_stars(self):
         """Test icSrc catalog."""
-        initial_psf_stars = self.butler.get("initial_psf_stars_detector", detector=self.detector,
-                                            visit=self.visit)
-        self.assertEqual(len(initial_psf_stars), 254)
+        for data_id, expected in self._get_detectors("initial_psf_stars_detector"):
+            with self.subTest(**data_id), track_peak_rss(self.peak_rss, f"psf stars {data_id['detector']}"):
+                initial_psf_stars = self.butler.get("initial_psf_stars_detector", data_id,
+                                                    collections=MAIN_CHAIN)
+                self.assertEqual(len(initial_psf_stars), expected["length"])
 
     def test_src(self):
         """Test src catalog."""
-        src = self.butler.get("src", detector=self.detector, visit=self.visit)
-        self.assertEqual(len(src), 785)
+        for data_id, expected in self._get_detectors("src"):
+            with self.subTest(**data_id), track_peak_rss(self.peak_rss, f"src {data_id['detector']}"):
+                src = self.butler.get("src", data_id, collections=MAIN_CHAIN)
+                self.assertEqual(len(src), expected["length"])
 
 
 def setup_module(module):